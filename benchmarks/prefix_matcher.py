@@ -0,0 +1,43 @@
+"""
+Compares the old per-message regex prefix lookup with the compiled PrefixMatcher.
+
+Run from the repository root with `python -m benchmarks.prefix_matcher`.
+"""
+import re
+import random
+import string
+import timeit
+
+from utils.utils import PrefixMatcher
+
+PREFIX_COUNTS = (1, 10, 50)  # 50 is TOTAL_PREFIX_LIMIT
+NUMBER = 20_000
+
+
+def old_get_prefix(prefixes: list, content: str):
+    prefixes = sorted(prefixes, key=len)
+    for prefix in prefixes:
+        match = re.match(rf"^({prefix}\s*).*", content, flags=re.IGNORECASE)
+        if match:
+            return match.group(1)
+
+
+def random_prefix():
+    return "".join(random.choices(string.ascii_lowercase + "!", k=random.randint(1, 10)))
+
+
+def main():
+    random.seed(0)
+    messages = ["just chatting about nothing in particular", "PB help", "lol"]
+    print(f"{'prefixes':>8} | {'old (us/msg)':>12} | {'new (us/msg)':>12} | speedup")
+    for count in PREFIX_COUNTS:
+        prefixes = ["pb"] + [random_prefix() for _ in range(count - 1)]
+        matcher = PrefixMatcher(prefixes)
+        old = timeit.timeit(lambda: [old_get_prefix(prefixes, m) for m in messages], number=NUMBER)
+        new = timeit.timeit(lambda: [matcher.match(m) for m in messages], number=NUMBER)
+        total = NUMBER * len(messages)
+        print(f"{count:>8} | {old / total * 1e6:>12.3f} | {new / total * 1e6:>12.3f} | {old / new:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
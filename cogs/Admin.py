@@ -4,6 +4,8 @@ import re
 import subprocess
 import typing
 import io
+import humanize
+import tracemalloc
 
 from discord.ext import commands, menus
 from selenium import webdriver
@@ -17,15 +19,31 @@ from config import config
 # constants
 
 SUPPORT_SERVER_ID = 798329404325101600
+SHARED_DISCORD_OBJECTS = (discord.Client, discord.state.ConnectionState, discord.Guild, discord.abc.GuildChannel,
+                          discord.abc.PrivateChannel)  # measured once on their own, not as part of everything else
+USER_OBJECTS = (discord.Member, discord.User, discord.ClientUser)
+TRACEMALLOC_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
 options = Options()
 options.add_argument("--headless")
 driver = webdriver.Chrome(config["webdriver_path"], chrome_options=options)
 
 
+def take_screenshot(url: str):
+    driver.get(url)
+    return driver.get_screenshot_as_png()
+
+
 class Admin(commands.Cog):
     """
     Commands that only my owner can use.
     """
+    def __init__(self):
+        self.memory_baseline = None  # tracemalloc snapshot that `admin memory diff` compares against
+
     async def cog_check(self, ctx: CustomContext):
         if not await ctx.bot.is_owner(ctx.author):
             raise commands.NotOwner
@@ -260,8 +278,7 @@ class Admin(commands.Cog):
         """
         Display all blacklisted users.
         """
-        data = list(dict(await ctx.bot.pool.fetch("SELECT * FROM blacklisted_users")).items())
-        await menus.MenuPages(utils.BlacklistSource(data, per_page=10), delete_message_after=True).start(ctx)
+        await menus.MenuPages(utils.BlacklistSource(ctx.bot.pool, per_page=10), delete_message_after=True).start(ctx)
 
     @blacklist.command()
     async def add(self, ctx: CustomContext, user: discord.User, *, reason: str = None):
@@ -285,6 +302,260 @@ class Admin(commands.Cog):
         await ctx.bot.cache.remove_blacklist(user.id)
         await ctx.send("👌")
 
+    @admin.command(name="cache")
+    async def cache_(self, ctx: CustomContext):
+        """
+        Displays the stats for the guild settings cache and the image result cache.
+        """
+        cache = ctx.bot.cache
+        stats = cache.guild_cache.stats()
+        stats["unsaved"] = f"{len(cache.dirty_guilds):,}"
+        embed = discord.Embed(
+            title="Guild Settings Cache",
+            description=f"```yaml\n{utils.padding(stats, separator=': ')}```",
+            colour=ctx.bot.embed_colour)
+        image_stats = {k: f"{v:,}" for k, v in cache.image_result_stats.items()}
+        image_stats["hit rate"] = f"{cache.image_result_hit_rate:.2%}"
+        image_stats["memory"] = f"{humanize.naturalsize(cache.image_results.size)}/" \
+                                f"{humanize.naturalsize(cache.image_results.maxsize)}"
+        image_stats["entries"] = f"{len(cache.image_results):,}"
+        image_stats["redis tier"] = "on" if cache.image_results_redis else "off"
+        embed.add_field(name="Image Results", value=f"```yaml\n{utils.padding(image_stats, separator=': ')}```")
+        await ctx.send(embed=embed)
+
+    @admin.command()
+    async def startup(self, ctx: CustomContext):
+        """
+        Displays how long each startup phase took.
+        """
+        timings = {k: f"{v * 1000:.2f}ms" for k, v in ctx.bot.startup_timings.items()}
+        embed = discord.Embed(
+            title="Startup Timings",
+            description=f"```yaml\n{utils.padding(timings, separator=': ') if timings else 'No timings recorded.'}```",
+            colour=ctx.bot.embed_colour)
+        await ctx.send(embed=embed)
+
+    @admin.command(aliases=["resources", "proc"])
+    async def process(self, ctx: CustomContext):
+        """
+        Displays the bot's resource usage over the last hour.
+        """
+        resources = ctx.bot.resources
+        samples = list(resources.samples)  # the sampler thread keeps appending to the deque
+        if not samples:
+            return await ctx.send("No samples yet, try again in a few seconds.")
+        series = {
+            "cpu": ([sample.cpu for sample in samples], lambda v: f"{v:.1f}%"),
+            "rss": ([sample.rss for sample in samples], humanize.naturalsize),
+            "uss": ([sample.uss for sample in samples], humanize.naturalsize),
+            "threads": ([sample.threads for sample in samples], str),
+            "open fds": ([sample.fds for sample in samples], str),
+            "asyncio tasks": ([sample.tasks for sample in samples], str),
+        }
+        embed = discord.Embed(title="Process Resources", colour=ctx.bot.embed_colour)
+        for name, (values, fmt) in series.items():
+            embed.add_field(
+                name=name.title(),
+                value=f"```\n{utils.sparkline(values[-40:])}\n"
+                      f"now {fmt(values[-1])} | min {fmt(min(values))} | max {fmt(max(values))}```",
+                inline=False)
+        first, last = samples[0], samples[-1]
+        collections = {f"gen {generation}": f"{after - before:,}" for generation, (before, after)
+                       in enumerate(zip(first.gc_collections, last.gc_collections))}
+        embed.add_field(name="GC Collections", value=f"```py\n{utils.padding(collections, separator=' - ')}```")
+        embed.set_footer(text=f"{len(samples)} samples, one every {resources.interval} seconds, "
+                              f"covering the last {humanize.naturaldelta(last.when - first.when)}.")
+        await ctx.send(embed=embed)
+
+    @admin.command(aliases=["stalls"])
+    async def lag(self, ctx: CustomContext):
+        """
+        Displays the event loop lag and the stacks of the worst recent stalls.
+        """
+        monitor = ctx.bot.loop_monitor
+        embed = discord.Embed(
+            title="Event Loop Lag",
+            description=f"```yaml\n{utils.padding(monitor.stats(), separator=': ')}```",
+            colour=ctx.bot.embed_colour)
+        await ctx.send(embed=embed)
+        if stalls := monitor.worst_stalls():
+            await menus.MenuPages(utils.StallSource(stalls), delete_message_after=True).start(ctx)
+
+    @admin.group(invoke_without_command=True, aliases=["pools"])
+    async def executors(self, ctx: CustomContext):
+        """
+        Displays the queue and timings of each executor.
+        """
+        headers = ["Name", "Workers", "Queued", "Running", "Done", "Wait p50/p99", "Run p50/p99"]
+        table = utils.PrettyTable.fancy(headers)
+        for name, executor in ctx.bot.executors.items():
+            table.add_row((
+                name, f"{executor.workers} {executor.kind}", executor.queued, executor.running,
+                f"{executor.completed:,}",
+                *(f"{histogram.percentile(50) * 1000:,.0f}/{histogram.percentile(99) * 1000:,.0f}ms"
+                  for histogram in (executor.wait_times, executor.run_times))
+            ))
+        await ctx.send(f"```\n{table.build_table(autoscale=True)}```")
+
+    @executors.command()
+    async def resize(self, ctx: CustomContext, name: str, workers: int):
+        """
+        Changes how many workers an executor has. Jobs that were already submitted finish on the old workers.
+
+        `name` - The name of the executor.
+        `workers` - The new number of workers.
+        """
+        if (executor := ctx.bot.executors.get(name.lower())) is None:
+            return await ctx.send(f"Invalid executor provided. Valid executors:\n{', '.join(ctx.bot.executors)}")
+        if not executor.resizable:
+            return await ctx.send(f"The `{executor.name}` executor can't be resized.")
+        if workers < 1:
+            return await ctx.send("An executor needs at least one worker.")
+        executor.resize(workers)
+        await ctx.send("👌")
+
+    @admin.group(invoke_without_command=True, aliases=["mem"])
+    async def memory(self, ctx: CustomContext):
+        """
+        Displays the approximate deep size of the cache, discord.py's caches and the music queues.
+        """
+        bot = ctx.bot
+        cache = bot.cache
+        cache_sizes = {
+            "guild cache": cache.guild_cache,
+            "dirty guilds": cache.dirty_guilds,
+            "prefix matchers": cache.prefix_matchers,
+            "blacklist": cache.blacklist,
+            "command stats": cache.command_stats,
+            "command latencies": cache.command_latencies,
+            "socketstats": cache.socketstats,
+            "socket rates": cache.socket_rates,
+            "timers": bot.timers.heap,
+            "command registry": bot.registry.entries,
+            "loop stalls": bot.loop_monitor.stalls,
+            "latency probes": bot.prober.samples,
+            "resource samples": list(bot.resources.samples),
+        }
+        cache_sizes = {name: utils.deep_sizeof(obj, exclude=(commands.Bot,)) for name, obj in cache_sizes.items()}
+
+        state = bot._connection
+        members = [member for guild in bot.guilds for member in guild._members.values()]
+        discord_sizes = {
+            f"members ({len(members):,})":
+                utils.deep_sizeof(members, exclude=SHARED_DISCORD_OBJECTS + (discord.User,)),
+            f"users ({len(state._users):,})":
+                utils.deep_sizeof(list(state._users.values()), exclude=SHARED_DISCORD_OBJECTS),
+            f"messages ({len(bot.cached_messages):,})":
+                utils.deep_sizeof(list(bot.cached_messages), exclude=SHARED_DISCORD_OBJECTS + USER_OBJECTS),
+        }
+
+        player_sizes = {
+            f"{bot.get_guild(guild_id) or guild_id} ({len(player.queue)} tracks)":
+                utils.deep_sizeof(player.queue, exclude=SHARED_DISCORD_OBJECTS + USER_OBJECTS)
+            for guild_id, player in bot.wavelink.players.items()
+        }
+
+        embed = discord.Embed(title="Memory Usage", colour=bot.embed_colour)
+        for name, sizes in (("Cache", cache_sizes), ("Discord", discord_sizes), ("Music Queues", player_sizes)):
+            total = humanize.naturalsize(sum(sizes.values()))
+            sizes = {k: humanize.naturalsize(v) for k, v in sorted(sizes.items(), key=lambda item: -item[1])}
+            embed.add_field(
+                name=f"{name} ({total})",
+                value=f"```yaml\n{utils.padding(sizes, separator=': ') if sizes else 'Nothing to measure.'}```",
+                inline=False)
+        if tracemalloc.is_tracing():
+            tracing = f"on, using {humanize.naturalsize(tracemalloc.get_tracemalloc_memory())}"
+        else:
+            tracing = "off"
+        embed.set_footer(text=f"Sizes are approximate. tracemalloc is {tracing}.")
+        await ctx.send(embed=embed)
+
+    @memory.command(name="start")
+    async def memory_start(self, ctx: CustomContext, frames: int = 1):
+        """
+        Starts tracing memory allocations and takes the first snapshot.
+
+        `frames` - How many frames of each allocation's traceback to store. Defaults to 1.
+        """
+        if tracemalloc.is_tracing():
+            return await ctx.send("tracemalloc is already running.")
+        tracemalloc.start(frames)
+        self.memory_baseline = tracemalloc.take_snapshot().filter_traces(TRACEMALLOC_FILTERS)
+        await ctx.send("👌")
+
+    @memory.command(name="stop")
+    async def memory_stop(self, ctx: CustomContext):
+        """
+        Stops tracing memory allocations and frees the traces.
+        """
+        if not tracemalloc.is_tracing():
+            return await ctx.send("tracemalloc isn't running.")
+        tracemalloc.stop()
+        self.memory_baseline = None
+        await ctx.send("👌")
+
+    async def take_snapshot(self, ctx: CustomContext):
+        # taking and filtering a snapshot can take a while with a lot of traces
+        return await ctx.bot.loop.run_in_executor(
+            None, lambda: tracemalloc.take_snapshot().filter_traces(TRACEMALLOC_FILTERS))
+
+    @memory.command(name="top")
+    async def memory_top(self, ctx: CustomContext):
+        """
+        Displays the lines that currently hold the most traced memory.
+        """
+        if not tracemalloc.is_tracing():
+            return await ctx.send(f"tracemalloc isn't running. Start it with `{ctx.prefix}admin memory start`.")
+        snapshot = await self.take_snapshot(ctx)
+        stats = await ctx.bot.loop.run_in_executor(None, snapshot.statistics, "lineno")
+        await menus.MenuPages(
+            utils.AllocationSource(stats, title="Top Allocation Sites"), delete_message_after=True).start(ctx)
+
+    @memory.command(name="diff")
+    async def memory_diff(self, ctx: CustomContext, *flags):
+        """
+        Displays the lines whose traced memory changed the most since the last snapshot.
+
+        **Flags:**
+        `-k|--keep` - If this flag is provided, the next diff is against the same snapshot instead of this one.
+        """
+        if not tracemalloc.is_tracing():
+            return await ctx.send(f"tracemalloc isn't running. Start it with `{ctx.prefix}admin memory start`.")
+        snapshot = await self.take_snapshot(ctx)
+        if self.memory_baseline is None:  # tracemalloc wasn't started with this command
+            self.memory_baseline = snapshot
+            return await ctx.send("There was no snapshot to compare against, so I took one. Run this again to see "
+                                  "what changed since now.")
+        stats = await ctx.bot.loop.run_in_executor(None, snapshot.compare_to, self.memory_baseline, "lineno")
+        if "-k" not in flags and "--keep" not in flags:
+            self.memory_baseline = snapshot
+        await menus.MenuPages(
+            utils.AllocationSource(stats, title="Allocation Changes"), delete_message_after=True).start(ctx)
+
+    @admin.command(aliases=["prof"])
+    async def profile(self, ctx: CustomContext, seconds: float = 10):
+        """
+        Profiles the bot and sends the results as a flame graph and as collapsed stacks.
+
+        `seconds` - How long to profile for. Defaults to 10, can't be more than 300.
+        """
+        profiler = ctx.bot.profiler
+        if profiler.running:
+            return await ctx.send("The profiler is already running.")
+        if not 0 < seconds <= 300:
+            return await ctx.send("You can only profile for up to 300 seconds.")
+        await ctx.send(f"Profiling for {seconds:g} seconds at {profiler.rate} samples per second...")
+        stacks = await profiler.profile(seconds)
+        if not stacks:
+            return await ctx.send("No samples were taken.")
+        title = f"{sum(stacks.values()):,} samples over {seconds:g} seconds"
+        collapsed = "\n".join(f"{stack} {count}" for stack, count in stacks.most_common())
+        svg = await ctx.bot.loop.run_in_executor(None, lambda: utils.flame_graph(stacks, title=title))
+        await ctx.send(
+            "Done! Load `profile.txt` into any flame graph tool, or open `profile.svg` in a browser.",
+            files=[discord.File(io.BytesIO(svg.encode("utf-8")), filename="profile.svg"),
+                   discord.File(io.BytesIO(collapsed.encode("utf-8")), filename="profile.txt")])
+
     @admin.command()
     async def sql(self, ctx: CustomContext, option: str, *, query: str):
         """
@@ -332,13 +603,12 @@ class Admin(commands.Cog):
         async with ctx.typing():
             with utils.StopWatch() as sw:
                 try:
-                    await ctx.bot.loop.run_in_executor(None, driver.get, url)
+                    png = await ctx.bot.loop.run_in_executor(ctx.bot.executors["screenshot"], take_screenshot, url)
                 except InvalidArgumentException:
                     return await ctx.send("Invalid url provided (did you forget the `http://` or `https://`?).")
                 except WebDriverException:
                     return await ctx.send("Couldn't screenshot that webpage.")
-            b = io.BytesIO(driver.get_screenshot_as_png())
-            file = discord.File(b, filename="screenshot.png")
+            file = discord.File(io.BytesIO(png), filename="screenshot.png")
             embed = discord.Embed(colour=ctx.bot.embed_colour, timestamp=datetime.datetime.now())
             embed.set_image(url="attachment://screenshot.png")
             embed.set_footer(text=f"Finished in {sw.elapsed:.3f} seconds")
@@ -1,9 +1,7 @@
 import discord
 import datetime
 import humanize
-import psutil
 import sys
-import inspect
 
 from discord.ext import commands, menus
 from jishaku import Jishaku
@@ -46,9 +44,8 @@ class BotInfo(commands.Cog, name="Bot Info"):
     @commands.Cog.listener()
     async def on_socket_response(self, message):
         if message["op"] == 0:
-            return self.bot.cache.socketstats.update([message["t"]])
-        msg = self.op_codes.get(message["op"], "NONE")
-        self.bot.cache.socketstats.update([msg])
+            return self.bot.cache.record_socket_event(message["t"])
+        self.bot.cache.record_socket_event(self.op_codes.get(message["op"], "NONE"))
 
     @commands.command(aliases=["up"])
     async def uptime(self, ctx: CustomContext):
@@ -58,39 +55,43 @@ class BotInfo(commands.Cog, name="Bot Info"):
         uptime = datetime.datetime.now() - ctx.bot.start_time
         await ctx.send(f"Bot has been online for **`{humanize.precisedelta(uptime)}`**.")
 
-    @commands.command(usage="[-rtt|--round-trip-time]")
+    @commands.command(usage="[-f|--fresh] [-rtt|--round-trip-time]")
     async def ping(self, ctx: CustomContext, *flags):
         """
-        Displays the websocket latency, api response time and the database response time.
+        Displays the websocket latency, and the api and database response times over the last hour.
 
         **Flags:**
+        `-f|--fresh` - If this flag is provided, every response time is measured again before being displayed.
         `-rtt|--round-trip-time` - If this flag is provided, round-trip time will also be displayed.
         """
         decimal_places = 5
+        fresh = "-f" in flags or "--fresh" in flags
+        rtt = "-rtt" in flags or "--round-trip-time" in flags
 
-        embed = discord.Embed(title="Pong!", colour=ctx.bot.embed_colour)
-        embed.add_field(name="Websocket Latency",
-                        value=f"```py\n{ctx.bot.latency * 1000:.{decimal_places}f}ms```")
-        embed.add_field(name="API Response Time",
-                        value=f"```py\n{(first_ping := await ctx.bot.api_ping(ctx)) * 1000:.{decimal_places}f}ms```")
-        embed.add_field(name="Database Ping (postgresql)",
-                        value=f"```py\n{await ctx.bot.postgresql_ping() * 1000:.{decimal_places}f}ms```")
-        embed.add_field(name="Database Ping (redis)",
-                        value=f"```py\n{await ctx.bot.redis_ping() * 1000:.{decimal_places}f}ms```")
-
-        if "-rtt" in flags or "--round-trip-time" in flags:
+        if fresh or rtt:
             # cooldown check
             bucket = self.rtt_cooldown.get_bucket(ctx.message)
             retry_after = bucket.update_rate_limit()
             if retry_after:
                 raise commands.CommandOnCooldown(bucket, retry_after)
 
-            rtts = [first_ping] + [await ctx.bot.api_ping(ctx) for _ in range(4)]  # makes 5 api requests instead of 6
+        if fresh or not ctx.bot.prober.summaries():
+            await ctx.bot.prober.probe()
+
+        embed = discord.Embed(title="Pong!", colour=ctx.bot.embed_colour)
+        embed.add_field(name="Websocket Latency",
+                        value=f"```py\n{ctx.bot.latency * 1000:.{decimal_places}f}ms```")
+        for name, summary in ctx.bot.prober.summaries().items():
+            summary = {k: f"{v * 1000:.2f}ms" for k, v in summary.items()}
+            embed.add_field(name=f"{name} Response Time",
+                            value=f"```py\n{utils.padding(summary, separator=' - ')}```")
+
+        if rtt:
+            rtts = [await ctx.bot.api_ping(ctx) for _ in range(5)]  # sequential on purpose, each one is a round trip
             rtt_str = "\n".join(f"Reading {number}: {ms * 1000:{decimal_places}f}ms" for number, ms in enumerate(rtts, start=1))
-            embed.insert_field_at(2, name="\u200b", value="\u200b")
-            embed.add_field(name="\u200b", value="\u200b")
-            embed.add_field(name="Round-Trip Time", value=f"```py\n{rtt_str}```")
+            embed.add_field(name="Round-Trip Time", value=f"```py\n{rtt_str}```", inline=False)
 
+        embed.set_footer(text=f"Sampled every {ctx.bot.prober.interval} seconds.")
         await ctx.send(embed=embed)
 
     @commands.command()
@@ -99,15 +100,16 @@ class BotInfo(commands.Cog, name="Bot Info"):
         Displays information about the bot.
         """
         v = sys.version_info
-        p = psutil.Process()
-        m = p.memory_full_info()
-        top5commands_today = ctx.bot.cache.command_stats["top_commands_today"].most_common(5)
+        resources = ctx.bot.resources
+        top5commands_today, = await ctx.bot.cache.get_top_stats("top_commands_today")
         uptime = datetime.datetime.now() - ctx.bot.start_time
+        message_filter = ctx.bot.message_filter_stats
         recent_commits = await ctx.bot.get_recent_commits()
-        latencies = {k: f"{v * 1000:.2f}ms" for k, v in zip(
-            ["Websocket Latency", "API Response Time", "Database Ping (postgresql)", "Database Ping (redis)"],
-            [ctx.bot.latency, await ctx.bot.api_ping(ctx), await ctx.bot.postgresql_ping(), await ctx.bot.redis_ping()]
-        )}
+        if not ctx.bot.prober.summaries():
+            await ctx.bot.prober.probe()
+        latencies = {"Websocket Latency": f"{ctx.bot.latency * 1000:.2f}ms"}
+        latencies.update({f"{name} (median)": f"{summary['median'] * 1000:.2f}ms"
+                          for name, summary in ctx.bot.prober.summaries().items()})
 
         embed = discord.Embed(title="Bot Info", colour=ctx.bot.embed_colour)
         embed.set_thumbnail(url=ctx.bot.user.avatar_url)
@@ -119,7 +121,9 @@ class BotInfo(commands.Cog, name="Bot Info"):
             f"• Running discord.py version **{discord.__version__}** on python **{v.major}.{v.minor}.{v.micro}**\n"
             f"• This bot is not sharded and can see **{len(ctx.bot.guilds)}** servers and **{len(ctx.bot.users)}** users\n"
             f"• **{len(ctx.bot.cogs)}** cogs loaded and **{len(ctx.bot.commands)}** commands loaded\n"
-            f"• **Uptime since last restart:** {humanize.precisedelta(uptime)}", inline=False)
+            f"• **Uptime since last restart:** {humanize.precisedelta(uptime)}\n"
+            f"• **{message_filter['rejected']:,}** of **{sum(message_filter.values()):,}** messages skipped by the prefix pre-filter",
+            inline=False)
 
         embed.add_field(
             name="What's New",
@@ -128,13 +132,20 @@ class BotInfo(commands.Cog, name="Bot Info"):
 
         embed.add_field(name="Top 5 Commands Today", value=top5(top5commands_today) or "No commands have been used today.")
 
-        embed.add_field(
-            name="System",
-            value=
-            f"• `{p.cpu_percent()}%` cpu\n"
-            f"• `{humanize.naturalsize(m.rss)}` physical memory\n"
-            f"• `{humanize.naturalsize(m.vms)}` virtual memory\n"
-            f"• running on PID `{p.pid}` with `{p.num_threads()}` thread(s)",)
+        if (sample := resources.latest) is not None:
+            first = resources.samples[0]
+            rss_change = sample.rss - first.rss
+            embed.add_field(
+                name="System",
+                value=
+                f"• `{resources.average_cpu(5 * 60):.1f}%` cpu (5 minute average)\n"
+                f"• `{humanize.naturalsize(sample.rss)}` physical memory "
+                f"(`{'+' if rss_change >= 0 else '-'}{humanize.naturalsize(abs(rss_change))}` in the last "
+                f"{humanize.naturaldelta(sample.when - first.when)})\n"
+                f"• `{humanize.naturalsize(sample.vms)}` virtual memory\n"
+                f"• running on PID `{resources.process.pid}` with `{sample.threads}` thread(s)",)
+        else:
+            embed.add_field(name="System", value="Not sampled yet, try again in a few seconds.")
 
         embed.add_field(
             name="Latency Info",
@@ -245,19 +256,11 @@ class BotInfo(commands.Cog, name="Bot Info"):
         if isinstance(command.cog, Jishaku):
             return await ctx.send("<https://github.com/Gorialis/jishaku>")
 
-        if isinstance(command, commands.HelpCommand):
-            lines, starting_line_num = inspect.getsourcelines(type(command))
-            filepath = f"{command.__module__.replace('.', '/')}.py"
-        else:
-            lines, starting_line_num = inspect.getsourcelines(command.callback.__code__)
-            filepath = f"{command.callback.__module__.replace('.', '/')}.py"
-
-        ending_line_num = starting_line_num + len(lines) - 1
-        command = "help" if isinstance(command, commands.HelpCommand) else command
+        info = ctx.bot.registry.command_info(command)
         embed = discord.Embed(
-            title=f"Here is my source code for the `{command}` command.",
+            title=f"Here is my source code for the `{info.qualified_name}` command.",
             description="Don't forget the license! (A star would also be appreciated ^^)",
-            url=f"https://github.com/PB4162/PB-Bot/blob/master/{filepath}#L{starting_line_num}-L{ending_line_num}",
+            url=f"https://github.com/PB4162/PB-Bot/blob/master/{info.filepath}#L{info.first_line}-L{info.last_line}",
             colour=ctx.bot.embed_colour)
         await ctx.send(embed=embed)
 
@@ -266,12 +269,11 @@ class BotInfo(commands.Cog, name="Bot Info"):
         """
         Displays the command usage stats.
         """
-        top5commands_today = ctx.bot.cache.command_stats["top_commands_today"].most_common(5)
-        top5commands_overall = ctx.bot.cache.command_stats["top_commands_overall"].most_common(5)
-        top5users_today = [(f"<@!{user_id}>", counter)
-                           for user_id, counter in ctx.bot.cache.command_stats["top_users_today"].most_common(5)]
-        top5users_overall = [(f"<@!{user_id}>", counter)
-                             for user_id, counter in ctx.bot.cache.command_stats["top_users_overall"].most_common(5)]
+        top5commands_today, top5commands_overall, top5users_today, top5users_overall = \
+            await ctx.bot.cache.get_top_stats(
+                "top_commands_today", "top_commands_overall", "top_users_today", "top_users_overall")
+        top5users_today = [(f"<@!{user_id}>", counter) for user_id, counter in top5users_today]
+        top5users_overall = [(f"<@!{user_id}>", counter) for user_id, counter in top5users_overall]
 
         embed = discord.Embed(title="Command Stats", colour=ctx.bot.embed_colour)
         embed.add_field(name="Top 5 Commands Today", value=top5(top5commands_today) or "No commands have been used today.")
@@ -283,6 +285,22 @@ class BotInfo(commands.Cog, name="Bot Info"):
 
         await ctx.send(embed=embed)
 
+    @commands.command(aliases=["cmdlatency"])
+    async def latencies(self, ctx: CustomContext, *, command: str = None):
+        """
+        Displays how long commands take to run, with the median (p50), p95 and p99 times.
+
+        `command` - Only show this command (optional). Shows every command by default.
+        """
+        latencies = ctx.bot.cache.command_latencies
+        if command is not None:
+            if (cmd := ctx.bot.get_command(command)) is None or cmd.qualified_name not in latencies:
+                return await ctx.send("Couldn't find any timings for that command.")
+            data = [(cmd.qualified_name, latencies[cmd.qualified_name])]
+        else:
+            data = sorted(latencies.items(), key=lambda item: item[1].total, reverse=True)
+        await menus.MenuPages(utils.LatencySource(data), clear_reactions_after=True).start(ctx)
+
     @commands.command()
     async def support(self, ctx: CustomContext):
         """
@@ -303,10 +321,12 @@ class BotInfo(commands.Cog, name="Bot Info"):
     @commands.command()
     async def socketstats(self, ctx: CustomContext):
         """
-        Displays the socketstats.
+        Displays how many of each gateway event the bot has received, and how many per second it is receiving now.
         """
+        cache = ctx.bot.cache
         menu = menus.MenuPages(
-            utils.SocketStatsSource(ctx.bot.cache.socketstats.most_common()),
+            utils.SocketStatsSource(
+                [(event, total, cache.socket_rates.rates(event)) for event, total in cache.socketstats.most_common()]),
             clear_reactions_after=True
         )
         await menu.start(ctx)
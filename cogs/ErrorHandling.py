@@ -1,6 +1,5 @@
 import discord
 import traceback
-import difflib
 import re
 
 from contextlib import suppress
@@ -9,6 +8,9 @@ from discord.ext import commands
 from utils import utils
 from utils.classes import CustomContext, StopSpammingMe
 
+# matches whatever follows the prefix, use with pos=len(ctx.prefix)
+FAILED_COMMAND_REGEX = re.compile(r"\s*(.*)")
+
 
 class ErrorHandling(commands.Cog):
     """
@@ -28,8 +30,8 @@ class ErrorHandling(commands.Cog):
         error = getattr(error, "original", error)
 
         if isinstance(error, commands.CommandNotFound):
-            failed_command = re.match(rf"^({ctx.prefix})\s*(.*)", ctx.message.content, flags=re.IGNORECASE).group(2)
-            matches = difflib.get_close_matches(failed_command, ctx.bot.command_list)
+            failed_command = FAILED_COMMAND_REGEX.match(ctx.message.content, len(ctx.prefix)).group(1)
+            matches = ctx.bot.get_suggestions(failed_command)
             if not matches:
                 return
             await ctx.send(f"Command '{failed_command}' is not found. Did you mean `{matches[0]}`?")
@@ -1,5 +1,4 @@
 import discord
-import difflib
 
 from discord.ext import commands
 from contextlib import suppress
@@ -27,73 +26,61 @@ class CustomHelpCommand(commands.HelpCommand):
         with suppress(discord.HTTPException):
             await self.context.message.add_reaction("\N{WHITE HEAVY CHECK MARK}")
 
-    async def send_command_help(self, command: commands.Command):
-        embed = discord.Embed(title=f"Help on Command `{command.name}`",
-                              description=command.help or "No info available.",
-                              colour=self.context.bot.embed_colour)
-        embed.add_field(name="Signature:", value=f"{command.name} {command.signature}", inline=False)
-        embed.add_field(name="Category:", value=f"{command.cog_name}", inline=False)
+    @property
+    def footer(self):
+        return (f"Type {self.context.clean_prefix}help (command) for more info on a command.\n"
+                f"You can also type {self.context.clean_prefix}help (category) for more info on a category.")
 
+    async def can_run(self, command: commands.Command):
         try:
             can_run = await command.can_run(self.context)
-            if can_run:
-                can_run = self.context.bot.emoji_dict["green_tick"]
-            else:
-                can_run = self.context.bot.emoji_dict["red_tick"]
         except commands.CommandError:
-            can_run = self.context.bot.emoji_dict["red_tick"]
-
-        embed.add_field(name="Can Use:", value=can_run)
-        embed.add_field(name="Aliases:", value="\n".join(command.aliases) or "None", inline=False)
+            can_run = False
+        return self.context.bot.emoji_dict["green_tick" if can_run else "red_tick"]
+
+    def render_command_help(self, command: commands.Command):
+        info = self.context.bot.registry.command_info(command)
+        group = isinstance(command, commands.Group)
+        embed = discord.Embed(title=f"Help on Command{' Group' if group else ''} `{info.name}`",
+                              description=info.help or "No info available.",
+                              colour=self.context.bot.embed_colour)
+        embed.add_field(name="Signature:", value=f"{info.name} {info.signature}", inline=False)
+        embed.add_field(name="Category:", value=f"{info.category}", inline=False)
+        # "Can Use:" is inserted here for every invocation
+        embed.add_field(name="Aliases:", value="\n".join(info.aliases) or "None", inline=False)
+        if group:
+            embed.add_field(name="Commands in this Group:",
+                            value="\n".join(str(command) for command in command.walk_commands()) or "None")
         embed.set_thumbnail(url=self.context.bot.user.avatar_url)
+        return embed
 
-        embed.set_footer(
-            text=f"Type {self.context.clean_prefix}help (command) for more info on a command.\n"
-            f"You can also type {self.context.clean_prefix}help (category) for more info on a category.")
+    async def send_command_help(self, command: commands.Command):
+        embed = self.context.bot.registry.memo(
+            ("command_help", command.qualified_name), lambda: self.render_command_help(command)).copy()
+        embed.insert_field_at(2, name="Can Use:", value=await self.can_run(command))
+        embed.set_footer(text=self.footer)
         return await self.context.send(embed=embed)
 
-    async def send_cog_help(self, cog: commands.Cog):
+    def render_cog_help(self, cog: commands.Cog):
         embed = discord.Embed(title=f"Help on Category `{cog.qualified_name}`",
                               description=cog.description or "No info available.",
                               colour=self.context.bot.embed_colour)
         embed.add_field(name="Commands in this Category:",
                         value="\n".join(str(command) for command in cog.get_commands()) or "None")
         embed.set_thumbnail(url=self.context.bot.user.avatar_url)
+        return embed
 
-        embed.set_footer(
-            text=f"Type {self.context.clean_prefix}help (command) for more info on a command.\n"
-            f"You can also type {self.context.clean_prefix}help (category) for more info on a category.")
+    async def send_cog_help(self, cog: commands.Cog):
+        embed = self.context.bot.registry.memo(
+            ("cog_help", cog.qualified_name), lambda: self.render_cog_help(cog)).copy()
+        embed.set_footer(text=self.footer)
         return await self.context.send(embed=embed)
 
     async def send_group_help(self, group: commands.Group):
-        embed = discord.Embed(title=f"Help on Command Group `{group.name}`",
-                              description=group.help or "No info available.",
-                              colour=self.context.bot.embed_colour)
-        embed.add_field(name="Signature:", value=f"{group.name} {group.signature}", inline=False)
-        embed.add_field(name="Category:", value=f"{group.cog_name}", inline=False)
-
-        try:
-            can_run = await group.can_run(self.context)
-            if can_run:
-                can_run = self.context.bot.emoji_dict["green_tick"]
-            else:
-                can_run = self.context.bot.emoji_dict["red_tick"]
-        except commands.CommandError:
-            can_run = self.context.bot.emoji_dict["red_tick"]
-
-        embed.add_field(name="Can Use:", value=can_run)
-        embed.add_field(name="Aliases:", value="\n".join(group.aliases) or "None", inline=False)
-        embed.add_field(name="Commands in this Group:",
-                        value="\n".join(str(command) for command in group.walk_commands()) or "None")
-        embed.set_thumbnail(url=self.context.bot.user.avatar_url)
-
-        embed.set_footer(
-            text=f"Type {self.context.clean_prefix}help (command) for more info on a command.\n"
-            f"You can also type {self.context.clean_prefix}help (category) for more info on a category.")
-        return await self.context.send(embed=embed)
+        return await self.send_command_help(group)
 
     async def command_not_found(self, string: str):
-        matches = difflib.get_close_matches(string, self.context.bot.command_list)
+        matches = self.context.bot.get_suggestions(string)
         if not matches:
             return f"Command '{string}' is not found."
         top3 = "\n".join(matches[:3])
@@ -1,6 +1,8 @@
 import discord
 import polaroid
 import typing
+import functools
+import hashlib
 
 from discord.ext import commands
 from io import BytesIO
@@ -8,6 +10,20 @@ from io import BytesIO
 from utils import utils
 from utils.classes import CustomContext
 
+# filters that always give the same result for the same image, the random ones can't be cached
+DETERMINISTIC_FILTERS = {
+    "solarize", "grayscale", "colorize", "apply_gradient", "desaturate", "edge_detection", "emboss", "invert", "sepia"
+}
+
+
+def apply_filter(data: bytes, method: str, *args, **kwargs):
+    """
+    Decodes an image, applies a polaroid filter to it and encodes it as a png. Runs in the image process pool.
+    """
+    image = polaroid.Image(data)
+    getattr(image, method)(*args, **kwargs)
+    return image.save_bytes()
+
 
 class ImageManip(commands.Cog):
     """
@@ -16,35 +32,60 @@ class ImageManip(commands.Cog):
     @staticmethod
     async def get_image(ctx: CustomContext, image):
         if ctx.message.attachments:
-            return polaroid.Image(await ctx.message.attachments[0].read())
+            return await ctx.message.attachments[0].read()
         elif isinstance(image, discord.PartialEmoji):
-            return polaroid.Image(await image.url.read())
+            return await image.url.read()
         else:
             image = image or ctx.author
-            return polaroid.Image(await image.avatar_url_as(format="png").read())
+            return await image.avatar_url_as(format="png").read()
 
     @staticmethod
-    def _do_image_manip(image: polaroid.Image, method: str, *args, **kwargs):
-        method = getattr(image, method)
-        method(*args, **kwargs)
-        return image
+    def image_source(ctx: CustomContext, image):
+        """
+        Identifies the image without downloading it. Returns None for attachments, which have to be hashed.
+        """
+        if ctx.message.attachments:
+            return None
+        elif isinstance(image, discord.PartialEmoji):
+            return f"emoji:{image.id}"
+        else:
+            image = image or ctx.author
+            if image.avatar is None:
+                return f"default avatar:{image.default_avatar.value}"
+            return f"avatar:{image.id}:{image.avatar}"
 
     @staticmethod
-    def build_embed(ctx: CustomContext, image, *, filename: str, elapsed: int):
-        file = discord.File(BytesIO(image.save_bytes()), filename=f"{filename}.png")
+    def build_embed(ctx: CustomContext, png: bytes, *, filename: str, elapsed: int, cached: bool):
+        file = discord.File(BytesIO(png), filename=f"{filename}.png")
         embed = discord.Embed(colour=ctx.bot.embed_colour)
         embed.set_author(name=ctx.author, icon_url=ctx.author.avatar_url)
         embed.set_image(url=f"attachment://{filename}.png")
-        embed.set_footer(text=f"Finished in {elapsed:.3f} seconds")
+        embed.set_footer(text=f"Finished in {elapsed:.3f} seconds{' (cached)' if cached else ''} | "
+                              f"{ctx.bot.cache.image_result_hit_rate:.0%} cache hit rate")
         return embed, file
 
     async def do_img_manip(self, ctx: CustomContext, image, method: str, filename: str, *args, **kwargs):
+        cache = ctx.bot.cache
         async with ctx.typing():
             with utils.StopWatch() as sw:
-                image = await self.get_image(ctx, image)
-                image = await ctx.bot.loop.run_in_executor(None, self._do_image_manip, image, method, *args, **kwargs)
-            embed, file = self.build_embed(ctx, image, filename=filename, elapsed=sw.elapsed)
+                data = key = png = None
+                cacheable = method in DETERMINISTIC_FILTERS
+                if cacheable:
+                    source = self.image_source(ctx, image)
+                    if source is None:
+                        data = await self.get_image(ctx, image)
+                        source = f"sha256:{hashlib.sha256(data).hexdigest()}"
+                    key = cache.image_result_key(source, method, args, kwargs)
+                    png = await cache.get_image_result(key)
+                cached = png is not None
+                if not cached:
+                    data = data or await self.get_image(ctx, image)
+                    png = await ctx.bot.loop.run_in_executor(
+                        ctx.bot.executors["image"], functools.partial(apply_filter, data, method, *args, **kwargs))
+            embed, file = self.build_embed(ctx, png, filename=filename, elapsed=sw.elapsed, cached=cached)
             await ctx.send(embed=embed, file=file)
+            if cacheable and not cached:
+                await cache.store_image_result(key, png)
 
     @commands.command()
     async def solarize(self, ctx: CustomContext, *, image: typing.Union[discord.PartialEmoji, discord.Member] = None):
@@ -6,16 +6,19 @@ import numpy as np
 import datetime
 import typing
 import textwrap
+import humanize
 
 from discord.ext import commands, menus
+from contextlib import suppress
 
 from utils import utils
-from utils.classes import CustomContext
+from utils.classes import CustomContext, PB_Bot, Timer
 from config import config
 
 MAX_FILESIZE = 100_000
 TODO_TASK_LENGTH = 200
 TODO_LIST_LENGTH = 100
+MAX_REMINDER_DELAY = datetime.timedelta(days=5 * 365)
 pytesseract.pytesseract.tesseract_cmd = config["tesseract_path"]
 
 
@@ -23,6 +26,20 @@ class Meta(commands.Cog):
     """
     Commands that don't belong to any specific category.
     """
+    def __init__(self, bot: PB_Bot):
+        self.bot = bot
+
+    @commands.Cog.listener()
+    async def on_reminder_timer_complete(self, timer: Timer):
+        user_id = timer.extra["user_id"]
+        destination = self.bot.get_channel(timer.extra["channel_id"]) or self.bot.get_user(user_id)
+        if destination is None:
+            return
+        with suppress(discord.HTTPException):
+            await destination.send(
+                f"<@{user_id}>, you asked me to remind you about `{timer.extra['task']}`.\n{timer.extra['jump_url']}",
+                allowed_mentions=discord.AllowedMentions(users=[discord.Object(id=user_id)]))
+
     @commands.command()
     async def mystbin(self, ctx: CustomContext, *, text: str = None):
         """
@@ -132,7 +149,8 @@ class Meta(commands.Cog):
         """
         if not ctx.message.attachments:
             return await ctx.send("No attachment provided.")
-        ocr_result = await ctx.bot.loop.run_in_executor(None, self._ocr, await ctx.message.attachments[0].read())
+        ocr_result = await ctx.bot.loop.run_in_executor(
+            ctx.bot.executors["ocr"], self._ocr, await ctx.message.attachments[0].read())
         await ctx.send(f"Text to image result for **{ctx.author}**\n```{ocr_result}```")
 
     @commands.command()
@@ -160,9 +178,7 @@ class Meta(commands.Cog):
         """
         View the tasks in your todo list.
         """
-        entries = await ctx.bot.cache.get_todo(ctx.author.id) or []
-        li = [(number, item) for number, item in enumerate(entries, start=1)]
-        await menus.MenuPages(utils.TodoSource(li), delete_message_after=True).start(ctx)
+        await menus.MenuPages(utils.TodoSource(ctx.bot.cache, ctx.author.id), delete_message_after=True).start(ctx)
 
     @todo.command()
     async def add(self, ctx: CustomContext, *, task: str):
@@ -174,16 +190,11 @@ class Meta(commands.Cog):
         if len(task) > TODO_TASK_LENGTH:
             return await ctx.send(f"{ctx.bot.emoji_dict['red_tick']} Task is too long (>{TODO_TASK_LENGTH} characters).")
 
-        tasks = await ctx.bot.cache.get_todo(ctx.author.id)
-        if tasks is None:
-            await ctx.bot.cache.create_todo(ctx.author.id)
-        else:
-            if len(tasks) >= TODO_TASK_LENGTH:
-                return await ctx.send(f"{ctx.bot.emoji_dict['red_tick']} Sorry, you can only have {TODO_TASK_LENGTH} tasks in your todo list at a time.")
-            if task in tasks:
-                return await ctx.send(f"{ctx.bot.emoji_dict['red_tick']} That task is already in your todo list.")
+        if await ctx.bot.cache.count_todos(ctx.author.id) >= TODO_TASK_LENGTH:
+            return await ctx.send(f"{ctx.bot.emoji_dict['red_tick']} Sorry, you can only have {TODO_TASK_LENGTH} tasks in your todo list at a time.")
+        if not await ctx.bot.cache.add_todo(ctx.author.id, task):
+            return await ctx.send(f"{ctx.bot.emoji_dict['red_tick']} That task is already in your todo list.")
 
-        await ctx.bot.cache.add_todo(ctx.author.id, task)
         await ctx.send(f"{ctx.bot.emoji_dict['green_tick']} Added `{task}` to your todo list.")
 
     @todo.command()
@@ -193,22 +204,37 @@ class Meta(commands.Cog):
 
         `task` - The task to remove. Can be the task number or the task name.
         """
-        tasks = await ctx.bot.cache.get_todo(ctx.author.id)
-
-        if not tasks:
-            return await ctx.send(f"{ctx.bot.emoji_dict['red_tick']} Your todo list is empty.")
         # try with number
-        try:
-            task = tasks[int(task) - 1]
-            await ctx.bot.cache.remove_todo(ctx.author.id, task)
-        except (IndexError, ValueError):
-            # try with name
-            if task not in tasks:
-                return await ctx.send(f"{ctx.bot.emoji_dict['red_tick']} Couldn't find a task with that name or number.")
-            await ctx.bot.cache.remove_todo(ctx.author.id, task)
+        if task.isdigit() and (entry := await ctx.bot.cache.get_todo_by_number(ctx.author.id, int(task))):
+            task = entry["task"]
+            await ctx.bot.cache.remove_todo_at(ctx.author.id, entry["position"])
+        # try with name
+        elif not await ctx.bot.cache.remove_todo(ctx.author.id, task):
+            return await ctx.send(f"{ctx.bot.emoji_dict['red_tick']} Couldn't find a task with that name or number.")
 
         await ctx.send(f"{ctx.bot.emoji_dict['green_tick']} Removed `{task}` from your todo list.")
 
+    @todo.command()
+    async def remind(self, ctx: CustomContext, time: utils.ShortTime, *, task: str):
+        """
+        Get reminded about a task.
+
+        `time` - How long to wait before reminding you, e.g. `10m` or `2 days`.
+        `task` - The task. Can be the number of a task in your todo list or any text.
+        """
+        if task.isdigit() and (entry := await ctx.bot.cache.get_todo_by_number(ctx.author.id, int(task))):
+            task = entry["task"]
+        if len(task) > TODO_TASK_LENGTH:
+            return await ctx.send(f"{ctx.bot.emoji_dict['red_tick']} Task is too long (>{TODO_TASK_LENGTH} characters).")
+        if time > MAX_REMINDER_DELAY:
+            return await ctx.send(f"{ctx.bot.emoji_dict['red_tick']} I can only remind you about something up to "
+                                  f"{humanize.naturaldelta(MAX_REMINDER_DELAY)} from now.")
+
+        await ctx.bot.timers.create_timer(
+            "reminder", datetime.datetime.utcnow() + time,
+            user_id=ctx.author.id, channel_id=ctx.channel.id, task=task, jump_url=ctx.message.jump_url)
+        await ctx.send(f"{ctx.bot.emoji_dict['green_tick']} I'll remind you about `{task}` in {humanize.precisedelta(time)}.")
+
 
 def setup(bot):
-    bot.add_cog(Meta())
+    bot.add_cog(Meta(bot))
@@ -0,0 +1,205 @@
+import time
+
+from operator import attrgetter
+
+from aiohttp import web
+from discord.ext import commands
+
+from utils import utils
+from utils.classes import PB_Bot
+from config import config
+
+DEFAULT_METRICS_HOST = "127.0.0.1"
+DEFAULT_METRICS_PORT = 9100
+LATENCY_QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Metrics(commands.Cog):
+    """
+    Serves the bot's health metrics in the Prometheus text format so that they can be scraped without going through
+    discord. Only started if `metrics` is set in the config, e.g. `{"host": "127.0.0.1", "port": 9100}`.
+    """
+    def __init__(self, bot: PB_Bot):
+        self.bot = bot
+        self.runner = None
+        if config.get("metrics") is not None:
+            bot.loop.create_task(self.start_server())
+
+    def cog_unload(self):
+        if self.runner is not None:
+            self.bot.loop.create_task(self.runner.cleanup())
+
+    async def start_server(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self.metrics)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(
+            self.runner,
+            config["metrics"].get("host", DEFAULT_METRICS_HOST),
+            config["metrics"].get("port", DEFAULT_METRICS_PORT)
+        )
+        await site.start()
+
+    async def metrics(self, request: web.Request):
+        writer = utils.MetricsWriter()
+        self.write_gateway(writer)
+        self.write_commands(writer)
+        self.write_cache(writer)
+        self.write_database(writer)
+        self.write_probes(writer)
+        self.write_executor(writer)
+        self.write_lavalink(writer)
+        return web.Response(text=writer.render(), content_type="text/plain", charset="utf-8",
+                            headers={"Cache-Control": "no-store"})
+
+    # collectors
+
+    def write_gateway(self, writer: utils.MetricsWriter):
+        writer.metric("gateway_latency_seconds", "gauge", "Time between a heartbeat and its acknowledgement.")
+        writer.sample("gateway_latency_seconds", self.bot.latency)
+
+        writer.metric("uptime_seconds", "gauge", "Seconds since the bot was started.")
+        writer.sample("uptime_seconds", time.time() - self.bot.start_time.timestamp())
+
+        monitor = self.bot.loop_monitor
+        writer.metric("event_loop_lag_seconds", "summary", "How late the event loop is at waking up a sleeping task.")
+        for quantile in LATENCY_QUANTILES:
+            writer.sample("event_loop_lag_seconds", monitor.lag.percentile(quantile * 100), quantile=quantile)
+        writer.sample("event_loop_lag_seconds_count", monitor.lag.total)
+
+        writer.metric("event_loop_stalls_total", "counter", "Times the event loop was blocked past the threshold.")
+        writer.sample("event_loop_stalls_total", monitor.stall_count)
+
+        writer.metric("guilds", "gauge", "Number of guilds the bot can see.")
+        writer.sample("guilds", len(self.bot.guilds))
+
+        writer.metric("socket_events_total", "counter", "Gateway events received, persisted across restarts.")
+        for event, count in self.bot.cache.socketstats.items():
+            writer.sample("socket_events_total", count, event=event)
+
+        writer.metric("messages_total", "counter", "Messages seen by the prefix pre-filter.")
+        for result, count in self.bot.message_filter_stats.items():
+            writer.sample("messages_total", count, result=result)
+
+    def write_commands(self, writer: utils.MetricsWriter):
+        latencies = self.bot.cache.command_latencies
+
+        writer.metric("commands_total", "counter", "Commands invoked since the latencies were first recorded.")
+        for command, histogram in latencies.items():
+            writer.sample("commands_total", histogram.successes, command=command, status="success")
+            writer.sample("commands_total", histogram.failures, command=command, status="failure")
+
+        writer.metric("command_latency_seconds", "summary", "Time taken to run a command.")
+        for command, histogram in latencies.items():
+            for quantile in LATENCY_QUANTILES:
+                writer.sample("command_latency_seconds", histogram.percentile(quantile * 100),
+                              command=command, quantile=quantile)
+            writer.sample("command_latency_seconds_count", histogram.total, command=command)
+
+    def write_cache(self, writer: utils.MetricsWriter):
+        cache = self.bot.cache
+        sizes = {
+            "guild_cache": len(cache.guild_cache),
+            "dirty_guilds": len(cache.dirty_guilds),
+            "prefix_matchers": len(cache.prefix_matchers),
+            "blacklist": len(cache.blacklist),
+            "socketstats": len(cache.socketstats),
+            "command_latencies": len(cache.command_latencies),
+            "timers": len(self.bot.timers.heap),
+            "image_results": len(cache.image_results),
+        }
+        writer.metric("cache_entries", "gauge", "Number of entries held by each part of the cache.")
+        for name, size in sizes.items():
+            writer.sample("cache_entries", size, cache=name)
+
+        guild_cache = cache.guild_cache
+        writer.metric("guild_cache_requests_total", "counter", "Guild cache lookups.")
+        writer.sample("guild_cache_requests_total", guild_cache.hits, result="hit")
+        writer.sample("guild_cache_requests_total", guild_cache.misses, result="miss")
+
+        writer.metric("image_result_cache_bytes", "gauge", "Bytes of filtered images held in memory.")
+        writer.sample("image_result_cache_bytes", cache.image_results.size)
+
+        writer.metric("image_result_requests_total", "counter", "Image filter result lookups.")
+        for result, count in cache.image_result_stats.items():
+            writer.sample("image_result_requests_total", count, result=result.replace(" ", "_"))
+
+    def write_database(self, writer: utils.MetricsWriter):
+        pool = self.bot.pool
+        writer.metric("postgresql_pool_connections", "gauge", "Connections held by the asyncpg pool.")
+        writer.sample("postgresql_pool_connections", pool.get_size() - pool.get_idle_size(), state="in_use")
+        writer.sample("postgresql_pool_connections", pool.get_idle_size(), state="idle")
+
+        writer.metric("postgresql_pool_max_connections", "gauge", "Maximum size of the asyncpg pool.")
+        writer.sample("postgresql_pool_max_connections", pool.get_max_size())
+
+    def write_probes(self, writer: utils.MetricsWriter):
+        prober = self.bot.prober
+        writer.metric("probe_latency_seconds", "gauge", "Summary of the recent background latency probes.")
+        for name, summary in prober.summaries().items():
+            for stat, value in summary.items():
+                writer.sample("probe_latency_seconds", value, probe=name, stat=stat)
+
+        writer.metric("probe_failures_total", "counter", "Latency probes that errored or timed out.")
+        for name in prober.probes:
+            writer.sample("probe_failures_total", prober.failures[name], probe=name)
+
+    def write_executor(self, writer: utils.MetricsWriter):
+        default = self.bot.loop._default_executor  # None until the first run_in_executor call
+        executors = self.bot.executors
+
+        writer.metric("executor_queue_depth", "gauge", "Jobs waiting for a free worker.")
+        writer.sample("executor_queue_depth", default._work_queue.qsize() if default else 0, executor="default")
+        for name, executor in executors.items():
+            writer.sample("executor_queue_depth", executor.queued, executor=name)
+
+        writer.metric("executor_workers", "gauge", "Maximum number of workers of the executor.")
+        for name, executor in executors.items():
+            writer.sample("executor_workers", executor.workers, executor=name)
+
+        writer.metric("executor_jobs_total", "counter", "Jobs completed by the executor.")
+        for name, executor in executors.items():
+            writer.sample("executor_jobs_total", executor.run_times.successes, executor=name, status="success")
+            writer.sample("executor_jobs_total", executor.run_times.failures, executor=name, status="failure")
+
+        writer.metric("executor_restarts_total", "counter", "Times the executor was replaced after a worker died.")
+        for name, executor in executors.items():
+            writer.sample("executor_restarts_total", executor.restarts, executor=name)
+
+        for metric, attribute, help_text in (
+                ("executor_wait_seconds", "wait_times", "Time jobs spent queued."),
+                ("executor_run_seconds", "run_times", "Time jobs spent running.")):
+            writer.metric(metric, "summary", help_text)
+            for name, executor in executors.items():
+                histogram = getattr(executor, attribute)
+                for quantile in LATENCY_QUANTILES:
+                    writer.sample(metric, histogram.percentile(quantile * 100), executor=name, quantile=quantile)
+                writer.sample(f"{metric}_count", histogram.total, executor=name)
+
+    def write_lavalink(self, writer: utils.MetricsWriter):
+        nodes = self.bot.wavelink.nodes
+        writer.metric("lavalink_players", "gauge", "Players connected to each lavalink node.")
+        for identifier, node in nodes.items():
+            writer.sample("lavalink_players", len(node.players), node=identifier, state="connected")
+            if node.stats is not None:
+                writer.sample("lavalink_players", node.stats.playing_players, node=identifier, state="playing")
+
+        stats = {
+            "lavalink_memory_used_bytes": ("memory_used", "Memory used by the lavalink JVM."),
+            "lavalink_system_load": ("system_load", "System cpu load reported by the node."),
+            "lavalink_load": ("lavalink_load", "Cpu load of the lavalink process."),
+            "lavalink_frames_sent": ("frames_sent", "Average audio frames sent per minute."),
+            "lavalink_frames_nulled": ("nulled", "Average audio frames nulled per minute."),
+            "lavalink_frames_deficit": ("deficit", "Average audio frames missing per minute."),
+            "lavalink_penalty": ("penalty.total", "Load balancing penalty of the node."),
+        }
+        for name, (attribute, help_text) in stats.items():
+            writer.metric(name, "gauge", help_text)
+            for identifier, node in nodes.items():
+                if node.stats is not None:
+                    writer.sample(name, attrgetter(attribute)(node.stats), node=identifier)
+
+
+def setup(bot):
+    bot.add_cog(Metrics(bot))
@@ -1,8 +1,22 @@
-CREATE TABLE IF NOT EXISTS todos (
-    user_id bigint PRIMARY KEY,
-    tasks text[] DEFAULT '{}'
+CREATE TABLE IF NOT EXISTS todo_tasks (
+    user_id  bigint,
+    position bigint,
+    task     text,
+    PRIMARY KEY (user_id, position),
+    UNIQUE (user_id, task)
 );
 
+-- move todo lists from the old one-array-per-user table
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM information_schema.tables WHERE table_name = 'todos') THEN
+        INSERT INTO todo_tasks (user_id, position, task)
+        SELECT user_id, t.position, t.task FROM todos, unnest(tasks) WITH ORDINALITY AS t(task, position)
+        ON CONFLICT DO NOTHING;
+        DROP TABLE todos;
+    END IF;
+END $$;
+
 CREATE TABLE IF NOT EXISTS errors (
     err_num    SERIAL,
     traceback  text,
@@ -25,3 +39,13 @@ CREATE TABLE IF NOT EXISTS blacklisted_users (
     user_id bigint PRIMARY KEY,
     reason text
 );
+
+CREATE TABLE IF NOT EXISTS timers (
+    id      SERIAL PRIMARY KEY,
+    event   text,
+    expires timestamp,
+    created timestamp DEFAULT (now() at time zone 'utc'),
+    extra   jsonb DEFAULT '{}'
+);
+
+CREATE INDEX IF NOT EXISTS timers_expires_idx ON timers (expires);
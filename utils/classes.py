@@ -7,43 +7,98 @@ import re
 import asyncio
 import asyncpg
 import json
+import gc
+import psutil
+import statistics
+import math
 import aioredis
 import typing
-
-from collections import Counter
+import pickle
+import struct
+import heapq
+import sys
+import threading
+import time
+import traceback
+import random
+import functools
+import hashlib
+import logging
+
+from collections import Counter, defaultdict, deque
+from contextlib import suppress, contextmanager
 from discord.ext import commands, tasks
 from copy import deepcopy
 from pyfiglet import Figlet
 
-from .utils import StopWatch
+from .utils import StopWatch, padding, PrefixMatcher, LRUCache, SuggestionIndex, CommandRegistry, \
+    LatencyHistogram, EventRates, short_path, Span, current_span, active_span, trace, start_span, InstrumentedExecutor
 from config import config
 
+log = logging.getLogger(__name__)
+
 # constants
 
 EMPTY_GUILD_CACHE = {"prefixes": []}
 DEFAULT_PREFIXES = ["pb"]
+MENTION_FIRST_CHAR = "<"
 EMBED_COLOUR = 0x01ad98
 BOT_ID = "719907834120110182"
 PERMISSIONS = 104189127
 DESCRIPTION = "An easy to use, multipurpose discord bot written in Python by PB#4162."
 COMMITS_URL = "https://api.github.com/repos/PB4162/PB-Bot/commits"
+GUILD_INFO_FLUSH_INTERVAL = 30  # seconds
+GUILD_CACHE_SIZE = 10_000
+GUILD_CACHE_TTL = 60 * 60  # seconds
+BLACKLIST_NOTICE_COOLDOWN = 10 * 60  # seconds
+STREAM_PREFETCH = 1000
+SNAPSHOT_PATH = "cache_snapshot.bin"
+SNAPSHOT_MAGIC = b"PBCACHE"
+SNAPSHOT_VERSION = 2
+SNAPSHOT_HEADER = struct.Struct("<7sH")
+TODO_INSERT_ATTEMPTS = 5
+TIMER_WINDOW = 256  # how many of the nearest timers are kept in memory
+TIMER_RETRY_DELAY = 1  # seconds, doubled after every failed attempt to dispatch
+TIMER_MAX_RETRY_DELAY = 5 * 60  # seconds
+COMMAND_STATS_KEYS = ("top_commands_today", "top_commands_overall", "top_users_today", "top_users_overall")
+LOOP_MONITOR_INTERVAL = 0.5  # seconds between heartbeats
+LOOP_STALL_THRESHOLD = 0.1  # seconds of lag before the blocking stack is captured
+LOOP_STALL_HISTORY = 25
+LOOP_STALL_STACK_DEPTH = 12
+PROBE_INTERVAL = 30  # seconds
+PROBE_HISTORY = 120  # samples kept per probe, an hour at the default interval
+PROBE_TIMEOUT = 10  # seconds
+RECENT_COMMITS_TTL = 10 * 60  # seconds
+RESOURCE_SAMPLE_INTERVAL = 15  # seconds
+RESOURCE_HISTORY = 240  # samples kept, an hour at the default interval
+PROFILER_RATE = 100  # samples per second
+PROFILER_IGNORED_THREADS = ("profiler", "loop-monitor", "resource-sampler")
+EXECUTOR_WORKER_FILE = os.path.join("concurrent", "futures", "thread.py")
+TRACE_SAMPLE_RATE = 0.1  # fraction of command invocations that are traced
+TRACE_PATH = "traces.jsonl"
+EXECUTORS = {
+    "image": {"kind": "process", "workers": max((os.cpu_count() or 2) - 1, 1)},  # leaves a core for the event loop
+    "ocr": {"kind": "thread", "workers": 1},
+    # there's only one selenium driver and it isn't thread safe
+    "screenshot": {"kind": "thread", "workers": 1, "resizable": False},
+}  # can be overridden per executor with the "executors" key in the config
+IMAGE_RESULT_CACHE_SIZE = 64 * 1024 * 1024  # bytes
+IMAGE_RESULT_MAX_SIZE = 8 * 1024 * 1024  # bytes, bigger results aren't cached
+IMAGE_RESULT_REDIS_TTL = 24 * 60 * 60  # seconds
+MISSING = object()
 
 
 async def get_prefix(bot, message: discord.Message):
     """
     Get prefix function.
     """
-    if not message.guild or (cache := await bot.cache.get_guild_info(message.guild.id)) is None:
-        prefixes = DEFAULT_PREFIXES
+    if not message.guild:
+        matcher = bot.cache.default_prefix_matcher
     else:
-        prefixes = cache["prefixes"]
-        if not prefixes:
-            prefixes = DEFAULT_PREFIXES
-    prefixes = sorted(prefixes, key=len)
-    for prefix in prefixes:
-        match = re.match(rf"^({prefix}\s*).*", message.content, flags=re.IGNORECASE)
-        if match:
-            return match.group(1)
+        matcher = await bot.cache.get_prefix_matcher(message.guild.id)
+    prefix = matcher.match(message.content)
+    if prefix is not None:
+        return prefix
     # fallback
     return commands.when_mentioned(bot, message)
 
@@ -55,6 +110,7 @@ class PB_Bot(commands.Bot):
     def __init__(self):
         intents = discord.Intents.default()
         intents.members = True
+        self.registry = CommandRegistry()  # must exist before super().__init__ adds the help command
         super().__init__(
             command_prefix=get_prefix,
             case_insensitive=True,
@@ -68,19 +124,35 @@ class PB_Bot(commands.Bot):
 
         # general stuff
         self.start_time = datetime.datetime.now()
-        self.session = aiohttp.ClientSession()
+        self.tracer = Tracer(self)
+        self.session = aiohttp.ClientSession(trace_configs=[self.tracer.http_trace_config()])
         self.wavelink = wavelink.Client(bot=self)
         self.coglist = [f"cogs.{item[:-3]}" for item in os.listdir("cogs") if item != "__pycache__"] + ["jishaku"]
         self.command_list = []
         self.figlet = Figlet()
+        self.startup_timings = {}
         self.embed_colour = EMBED_COLOUR
 
         # database connections
-        self.pool = asyncio.get_event_loop().run_until_complete(asyncpg.create_pool(**config["postgresql"]))
+        self.pool = TracedPool(
+            asyncio.get_event_loop().run_until_complete(asyncpg.create_pool(**config["postgresql"])))
         self.redis = asyncio.get_event_loop().run_until_complete(aioredis.create_redis_pool(config["redis"]))
+        self.tracer.instrument()
 
         # cache
         self.cache = Cache(self)
+        self.timers = TimerManager(self)
+        self.loop_monitor = LoopMonitor(self)
+        self.prober = LatencyProber(self)
+        self.resources = ResourceSampler(self)
+        self.profiler = SamplingProfiler(self)
+        self.executors = {
+            name: InstrumentedExecutor(name, **{**options, **config.get("executors", {}).get(name, {})})
+            for name, options in EXECUTORS.items()
+        }
+        self.command_tasks = {}  # task -> "Cog.command" that the task is running, read by the profiler
+        self.recent_commits = LRUCache(1, ttl=RECENT_COMMITS_TTL)
+        self.message_filter_stats = Counter({"accepted": 0, "rejected": 0})
 
         # links
         self.github_url = "https://github.com/PB4162/PB-Bot"
@@ -90,18 +162,14 @@ class PB_Bot(commands.Bot):
 
         # global ratelimit
         self.global_cooldown = commands.CooldownMapping.from_cooldown(rate=5, per=5, type=commands.BucketType.user)
+        self.blacklist_notice_cooldown = commands.CooldownMapping.from_cooldown(
+            rate=1, per=BLACKLIST_NOTICE_COOLDOWN, type=commands.BucketType.user)
 
         # global check
         @self.check
         async def global_check(ctx: CustomContext):
-            # check if blacklisted
+            # blacklisted users are normally dropped in on_message, this catches commands invoked any other way
             if await ctx.bot.cache.is_blacklisted(ctx.author.id):
-                embed = discord.Embed(
-                    description=f"{ctx.author.mention}, you have been blacklisted from this bot. If you think that this"
-                                f" was a mistake, please report it in the "
-                                f"[support server]({ctx.bot.support_server_invite}).",
-                    colour=ctx.bot.embed_colour)
-                await ctx.send(embed=embed)
                 return False
 
             # check if ratelimited
@@ -146,20 +214,61 @@ class PB_Bot(commands.Bot):
     async def on_message(self, message: discord.Message):
         if message.author.bot:
             return
+        if message.guild:
+            await self.cache.get_guild_info(message.guild.id)  # loads the guild's prefixes the first time it's seen
+        # cheap pre-filter so that ordinary chatter never builds a context
+        if not self.cache.could_be_command(message.content):
+            self.message_filter_stats["rejected"] += 1
+            return
+        self.message_filter_stats["accepted"] += 1
+        if await self.cache.is_blacklisted(message.author.id):
+            if isinstance(await self.get_prefix(message), str):  # only tell them if they actually tried a command
+                await self.send_blacklist_notice(message)
+            return
         if re.fullmatch(f"^(<@!?{self.user.id}>)\s*", message.content):
             ctx = await self.get_context(message)
             return await ctx.invoke(self.get_command("prefix"))
         await self.process_commands(message)
 
+    async def send_blacklist_notice(self, message: discord.Message):
+        bucket = self.blacklist_notice_cooldown.get_bucket(message)
+        if bucket.update_rate_limit():
+            return
+        embed = discord.Embed(
+            description=f"{message.author.mention}, you have been blacklisted from this bot. If you think that this"
+                        f" was a mistake, please report it in the "
+                        f"[support server]({self.support_server_invite}).",
+            colour=self.embed_colour)
+        with suppress(discord.HTTPException):
+            await message.channel.send(embed=embed)
+
     async def on_guild_leave(self, guild: discord.Guild):
         await self.cache.delete_guild_info(guild.id)
 
+    async def invoke(self, ctx):
+        if ctx.command is None:
+            return await super().invoke(ctx)
+        task = asyncio.current_task()
+        cog = ctx.cog.qualified_name if ctx.cog else "No Category"
+        self.command_tasks[task] = f"{cog}.{ctx.command.qualified_name}"
+        # timed here rather than in the command events, which run as separate tasks and would miss the synchronous
+        # start of the command. super().invoke handles command errors itself and sets command_failed.
+        try:
+            with StopWatch() as sw, self.tracer.trace_command(ctx):
+                await super().invoke(ctx)
+        except BaseException:
+            ctx.command_failed = True
+            raise
+        finally:
+            self.command_tasks.pop(task, None)
+            self.cache.command_latencies[ctx.command.qualified_name].record(sw.elapsed, failed=ctx.command_failed)
+
     async def on_command(self, ctx):
-        self.cache.command_stats["top_commands_today"].update({ctx.command.qualified_name: 1})
-        self.cache.command_stats["top_commands_overall"].update({ctx.command.qualified_name: 1})
+        self.cache.command_stats["top_commands_today"][ctx.command.qualified_name] += 1
+        self.cache.command_stats["top_commands_overall"][ctx.command.qualified_name] += 1
 
-        self.cache.command_stats["top_users_today"].update({str(ctx.author.id): 1})
-        self.cache.command_stats["top_users_overall"].update({str(ctx.author.id): 1})
+        self.cache.command_stats["top_users_today"][str(ctx.author.id)] += 1
+        self.cache.command_stats["top_users_overall"][str(ctx.author.id)] += 1
 
     # ping helpers
 
@@ -179,6 +288,20 @@ class PB_Bot(commands.Bot):
             await self.redis.ping()
         return sw.elapsed
 
+    async def rest_ping(self):
+        with StopWatch() as sw:
+            await self.http.get_gateway()
+        return sw.elapsed
+
+    async def lavalink_ping(self):
+        if not self.wavelink.nodes:
+            return None
+        node = next(iter(self.wavelink.nodes.values()))
+        with StopWatch() as sw:
+            async with self.session.get(f"{node.rest_uri}/version", headers={"Authorization": node.password}) as r:
+                await r.read()
+        return sw.elapsed
+
     # loops
 
     @tasks.loop(minutes=30)
@@ -206,9 +329,23 @@ class PB_Bot(commands.Bot):
         dt = midnight - datetime.datetime.now()
         await asyncio.sleep(dt.total_seconds())
 
+    # the dumps keep whatever they failed to write for the next iteration, so errors are logged instead of raised,
+    # raising would stop the loop for good
+
     @tasks.loop(minutes=5)
     async def dump_cmd_stats(self):
-        await self.cache.dump_cmd_stats()
+        for dump in (self.cache.dump_cmd_stats, self.cache.dump_cmd_latencies, self.cache.dump_socketstats):
+            try:
+                await dump()
+            except Exception:
+                log.exception("%s failed, retrying on the next dump", dump.__name__)
+
+    @tasks.loop(seconds=GUILD_INFO_FLUSH_INTERVAL)
+    async def flush_guild_info(self):
+        try:
+            await self.cache.dump_guild_info()
+        except Exception:
+            log.exception("Writing the dirty guild settings failed, retrying on the next flush")
 
     # pastebin
 
@@ -231,14 +368,33 @@ class PB_Bot(commands.Bot):
         return commands.check(predicate)
 
     async def get_recent_commits(self, limit: int = 4):
-        async with self.session.get(COMMITS_URL) as r:
-            commits = await r.json()
+        commits = self.recent_commits.get(COMMITS_URL)
+        if commits is None:
+            async with self.session.get(COMMITS_URL) as r:
+                commits = self.recent_commits[COMMITS_URL] = await r.json()
         return commits[:limit]
 
     async def schemas(self):
         with open("schemas.sql") as f:
             await self.pool.execute(f.read())
 
+    async def warm_up(self):
+        with StopWatch() as sw:
+            await self.schemas()
+        self.startup_timings["schemas"] = sw.elapsed
+
+        with StopWatch() as sw:
+            await self.cache.load_all()
+        self.startup_timings["cache (total)"] = sw.elapsed
+
+        log.info("Startup timings:\n%s",
+                 padding({k: f"{v * 1000:.2f}ms" for k, v in self.startup_timings.items()}, separator=" - "))
+
+    @staticmethod
+    def on_warm_up_done(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            log.error("Warming up the cache in the background failed", exc_info=task.exception())
+
     def get_all_subcommands(self, command):
         subcommands = []
         for cmd in command.commands:
@@ -249,28 +405,78 @@ class PB_Bot(commands.Bot):
         return subcommands
 
     def refresh_command_list(self):
+        command_list = []
         for command in self.commands:
-            self.command_list.append(str(command))
-            self.command_list.extend([alias for alias in command.aliases])
+            command_list.append(str(command))
+            command_list.extend([alias for alias in command.aliases])
             if isinstance(command, commands.Group):
-                self.command_list.extend(self.get_all_subcommands(command))
+                command_list.extend(self.get_all_subcommands(command))
+        self.command_list = list(dict.fromkeys(command_list))  # removes duplicates but keeps the order
+        return self.command_list
+
+    def get_suggestions(self, string: str):
+        index = self.registry.memo("suggestions", lambda: SuggestionIndex(self.refresh_command_list()))
+        return index.suggest(string)
+
+    # the registry is rebuilt lazily whenever a command or cog is added or removed
+
+    def add_command(self, command):
+        super().add_command(command)
+        self.registry.clear()
+
+    def remove_command(self, name):
+        command = super().remove_command(name)
+        self.registry.clear()
+        return command
+
+    def add_cog(self, cog):
+        super().add_cog(cog)
+        self.registry.clear()
+
+    def remove_cog(self, name):
+        super().remove_cog(name)
+        self.registry.clear()
 
     async def close(self):
+        self.timers.stop()
+        self.loop_monitor.stop()
+        self.prober.stop()
+        self.resources.stop()
+        for executor in self.executors.values():
+            executor.shutdown(wait=False)
         await self.cache.dump_all()
         await super().close()
 
     def run(self, *args, **kwargs):
-        for cog in self.coglist:
-            self.load_extension(cog)
+        with StopWatch() as sw:
+            for cog in self.coglist:
+                self.load_extension(cog)
+        self.startup_timings["extensions"] = sw.elapsed
 
-        self.loop.run_until_complete(self.schemas())
-        self.loop.run_until_complete(self.cache.load_all())
+        # start the workers now rather than on the first job
+        for executor in self.executors.values():
+            executor.warm_up()
+
+        with StopWatch() as sw:
+            warm_start = self.cache.load_snapshot()
+        self.startup_timings["snapshot"] = sw.elapsed
+
+        if warm_start:
+            # serve from the snapshot straight away and catch up with the databases in the background
+            self.loop.create_task(self.warm_up()).add_done_callback(self.on_warm_up_done)
+        else:
+            self.loop.run_until_complete(self.warm_up())
 
         self.refresh_command_list()
 
         self.presence_update.start()
         self.dump_cmd_stats.start()
+        self.flush_guild_info.start()
         self.clear_cmd_stats.start()
+        self.timers.start()
+        self.loop_monitor.start()
+        self.prober.start()
+        self.resources.start()
         super().run(*args, **kwargs)
 
 
@@ -278,48 +484,216 @@ class Cache:
     def __init__(self, bot: PB_Bot):
         self.bot = bot
 
-        self.guild_cache = {}
-        self.command_stats = {"top_commands_today": Counter(), "top_commands_overall": Counter(),
-                              "top_users_today": Counter(), "top_users_overall": Counter()}
-        self.blacklist = []
-        self.todos = {}
-        self.socketstats = Counter()
+        self.guild_cache = LRUCache(
+            config.get("guild_cache_size", GUILD_CACHE_SIZE),
+            ttl=config.get("guild_cache_ttl", GUILD_CACHE_TTL),
+            on_evict=self.on_guild_evict,
+            can_evict=lambda guild_id: guild_id not in self.dirty_guilds
+        )  # guild_id -> settings, or None if the guild has no row
+        self.dirty_guilds = set()  # guilds whose settings haven't been written to the database yet
+        self.guild_loads = {}  # guild_id -> future of a load that is in progress
+        self.snapshot_guilds = []  # guilds loaded from the snapshot that haven't been checked against the database
+        self.guild_info_lock = asyncio.Lock()
+        self.prefix_matchers = {}
+        self.default_prefix_matcher = PrefixMatcher(DEFAULT_PREFIXES)
+        self.prefix_first_chars = Counter()  # first character of every known prefix -> number of prefixes
+        self.index_prefixes(DEFAULT_PREFIXES + [MENTION_FIRST_CHAR])
+        self.command_stats = {key: Counter() for key in COMMAND_STATS_KEYS}  # increments not yet sent to redis
+        self.command_latencies = defaultdict(LatencyHistogram)
+        self.command_latencies_loaded = False  # dumping before the load would overwrite the persisted histograms
+        self.blacklist = set()
+        self.socketstats = Counter()  # lifetime totals, including the ones loaded from redis
+        self.socketstats_pending = Counter()  # increments not yet sent to redis
+        self.socket_rates = EventRates()
+        self.image_results = LRUCache(config.get("image_cache_size", IMAGE_RESULT_CACHE_SIZE), weigher=len)
+        self.image_results_redis = config.get("image_cache_redis", False)  # share results with other processes
+        self.image_result_stats = Counter({"memory hits": 0, "redis hits": 0, "misses": 0})
 
     async def load_all(self):
-        await self.load_guild_info()
-        await self.load_cmd_stats()
-        await self.load_blacklist()      # todo add spam violation counter
-        await self.load_todos()
+        await asyncio.gather(
+            self.timed_load("guild info", self.refresh_snapshot_guilds()),
+            self.timed_load("command stats", self.load_cmd_stats()),
+            self.timed_load("blacklist", self.load_blacklist()),      # todo add spam violation counter
+            self.timed_load("command latencies", self.load_cmd_latencies()),
+            self.timed_load("socketstats", self.load_socketstats()),
+        )
+
+    async def timed_load(self, name: str, coro: typing.Awaitable):
+        with StopWatch() as sw:
+            await coro
+        self.bot.startup_timings[f"cache: {name}"] = sw.elapsed
+
+    async def stream(self, query: str, *args):
+        """
+        Iterates over a query's rows with a server-side cursor instead of fetching them all at once.
+        """
+        async with self.bot.pool.acquire() as conn:
+            async with conn.transaction():
+                async for entry in conn.cursor(query, *args, prefetch=STREAM_PREFETCH):
+                    yield entry
 
     async def dump_all(self):
-        await self.dump_guild_info()
-        await self.dump_cmd_stats()
-        await self.dump_todos()
+        failed = False
+        for dump in (self.dump_guild_info, self.dump_cmd_stats, self.dump_cmd_latencies, self.dump_socketstats):
+            try:
+                await dump()
+            except Exception:
+                log.exception("%s failed while shutting down", dump.__name__)
+                failed = True
+        if not failed:  # the snapshot mustn't hold anything the databases don't
+            self.dump_snapshot()
+
+    # snapshot
+
+    def dump_snapshot(self):
+        """
+        Writes the cache to a local file so that the next start can serve commands before the databases answer.
+        Should only be called right after everything has been written to the databases.
+        """
+        data = {
+            "guild_cache": self.guild_cache.items(),
+            "blacklist": self.blacklist,
+        }
+        path = config.get("snapshot_path", SNAPSHOT_PATH)
+        with open(f"{path}.tmp", "wb") as f:
+            f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION))
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f"{path}.tmp", path)
+
+    def load_snapshot(self):
+        """
+        Loads the snapshot written by `dump_snapshot`. Returns False if there is no usable snapshot.
+        The snapshot is deleted once it has been read, so that a crash can't make a later start reuse it.
+        """
+        path = config.get("snapshot_path", SNAPSHOT_PATH)
+        try:
+            with open(path, "rb") as f:
+                magic, version = SNAPSHOT_HEADER.unpack(f.read(SNAPSHOT_HEADER.size))
+                if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+                    return False
+                data = pickle.load(f)
+        except (OSError, ValueError, struct.error, pickle.UnpicklingError, EOFError):
+            return False
+        finally:
+            with suppress(OSError):
+                os.remove(path)
+
+        for guild_id, guild_info in data["guild_cache"]:
+            self.cache_guild_info(guild_id, guild_info)
+        self.snapshot_guilds = [guild_id for guild_id, _ in data["guild_cache"]]
+        self.blacklist = data["blacklist"]
+        return True
 
     # guild info
 
-    async def load_guild_info(self):
-        data = await self.bot.pool.fetch("SELECT * FROM guild_info")
-        for entry in data:
-            self.guild_cache[entry["guild_id"]] = {k: v for k, v in list(entry.items())[1:]}  # skip the guild_id
+    async def load_guild_info(self, guild_id: int):
+        """
+        Loads a guild's settings into the cache. Concurrent misses for the same guild share a single query.
+        """
+        future = self.guild_loads.get(guild_id)
+        if future is None:
+            future = self.guild_loads[guild_id] = asyncio.ensure_future(self.fetch_guild_info(guild_id))
+            future.add_done_callback(lambda _: self.guild_loads.pop(guild_id, None))
+        return await asyncio.shield(future)  # one waiter being cancelled mustn't cancel the load for the others
+
+    async def fetch_guild_info(self, guild_id: int):
+        entry = await self.bot.pool.fetchrow("SELECT * FROM guild_info WHERE guild_id = $1", guild_id)
+        if (cached := self.guild_cache.peek(guild_id, MISSING)) is not MISSING:  # loaded while we were waiting
+            return cached
+        if entry is None:
+            return self.cache_guild_info(guild_id, None)
+        return self.cache_guild_info(guild_id, {k: v for k, v in list(entry.items())[1:]})  # skip the guild_id
+
+    async def refresh_snapshot_guilds(self):
+        """
+        Re-reads the guilds that were loaded from the snapshot, it can be older than the database.
+        """
+        guild_ids, self.snapshot_guilds = self.snapshot_guilds, []
+        if not guild_ids:
+            return
+        async with self.guild_info_lock:  # a flush in between could make the rows older than the cache
+            records = await self.bot.pool.fetch("SELECT * FROM guild_info WHERE guild_id = ANY($1)", guild_ids)
+            rows = {record["guild_id"]: {k: v for k, v in list(record.items())[1:]} for record in records}
+            for guild_id in guild_ids:
+                if guild_id in self.dirty_guilds or self.guild_cache.peek(guild_id, MISSING) is MISSING:
+                    continue  # edited or evicted since the start
+                self.cache_guild_info(guild_id, rows.get(guild_id))  # guilds without a row were deleted
+
+    def cache_guild_info(self, guild_id: int, data: typing.Optional[dict]):
+        self.guild_cache[guild_id] = data
+        self.on_guild_evict(guild_id, None)  # unindex the prefixes of anything cached before
+        if data is not None:
+            matcher = self.prefix_matchers[guild_id] = PrefixMatcher(data["prefixes"])
+            self.index_prefixes(matcher.prefixes)  # deduplicated, the same list is unindexed on eviction
+        return data
+
+    def on_guild_evict(self, guild_id: int, _):
+        if (matcher := self.prefix_matchers.pop(guild_id, None)) is not None:
+            self.unindex_prefixes(matcher.prefixes)
 
     async def dump_guild_info(self):
-        items = deepcopy(self.guild_cache).items()
-        for guild_id, data in items:
-            await self.bot.pool.execute("UPDATE guild_info SET prefixes = $1 WHERE guild_id = $2", data["prefixes"], guild_id)
-            # idk how to make this dynamic
+        """
+        Writes every dirty guild in a single upsert. Clean guilds are never touched.
+        """
+        async with self.guild_info_lock:
+            if not self.dirty_guilds:
+                return
+            dirty, self.dirty_guilds = self.dirty_guilds, set()
+            rows = [(guild_id, list(data["prefixes"]))
+                    for guild_id in dirty if (data := self.guild_cache.peek(guild_id)) is not None]
+            try:
+                await self.bot.pool.executemany(
+                    """INSERT INTO guild_info (guild_id, prefixes) VALUES ($1, $2)
+                    ON CONFLICT (guild_id) DO UPDATE SET prefixes = EXCLUDED.prefixes""", rows)
+            except Exception:
+                self.dirty_guilds |= dirty  # try again on the next flush
+                raise
+
+    def mark_guild_dirty(self, guild_id: int):
+        self.dirty_guilds.add(guild_id)
 
     async def create_guild_info(self, guild_id: int):
-        await self.bot.pool.execute("INSERT INTO guild_info VALUES ($1)", guild_id)
-        self.guild_cache[guild_id] = deepcopy(EMPTY_GUILD_CACHE)
-        return self.guild_cache[guild_id]
+        self.mark_guild_dirty(guild_id)
+        self.guild_cache[guild_id] = data = deepcopy(EMPTY_GUILD_CACHE)
+        self.prefix_matchers[guild_id] = PrefixMatcher()
+        return data
 
     async def delete_guild_info(self, guild_id: int):
-        await self.bot.pool.execute("DELETE FROM guild_info WHERE guild_id = $1", guild_id)
-        self.guild_cache.pop(guild_id, None)
+        async with self.guild_info_lock:
+            self.dirty_guilds.discard(guild_id)
+            await self.bot.pool.execute("DELETE FROM guild_info WHERE guild_id = $1", guild_id)
+        self.guild_cache[guild_id] = None
+        self.on_guild_evict(guild_id, None)
 
     async def get_guild_info(self, guild_id: int):
-        return self.guild_cache.get(guild_id, None)
+        data = self.guild_cache.get(guild_id, MISSING)
+        if data is MISSING:
+            data = await self.load_guild_info(guild_id)
+        return data
+
+    async def get_prefix_matcher(self, guild_id: int):
+        # on_message has normally looked the guild up already, peeking keeps it from counting twice in the stats
+        if self.guild_cache.peek(guild_id, MISSING) is MISSING:
+            await self.get_guild_info(guild_id)
+        matcher = self.prefix_matchers.get(guild_id, None)
+        if matcher is None or not matcher.prefixes:
+            return self.default_prefix_matcher
+        return matcher
+
+    # prefix pre-filter
+
+    def index_prefixes(self, prefixes: list):
+        self.prefix_first_chars.update(prefix[0].lower() for prefix in prefixes if prefix)
+
+    def unindex_prefixes(self, prefixes: list):
+        self.prefix_first_chars.subtract(prefix[0].lower() for prefix in prefixes if prefix)
+        self.prefix_first_chars += Counter()  # drop characters that are no longer used
+
+    def could_be_command(self, content: str):
+        """
+        Returns False if no known prefix can possibly match the message.
+        """
+        return content[:1].lower() in self.prefix_first_chars
 
     async def cleanup_guild_info(self, guild_id: int):
         cache = await self.get_guild_info(guild_id)
@@ -327,121 +701,763 @@ class Cache:
             await self.delete_guild_info(guild_id)
 
     async def add_prefix(self, guild_id: int, prefix: str):
-        await self.bot.pool.execute("UPDATE guild_info SET prefixes = array_append(prefixes, $1) WHERE guild_id = $2", prefix, guild_id)
         (await self.get_guild_info(guild_id))["prefixes"].append(prefix)
+        self.mark_guild_dirty(guild_id)
+        matcher = self.prefix_matchers[guild_id]
+        if prefix not in matcher.prefixes:
+            matcher.add(prefix)
+            self.index_prefixes([prefix])
 
     async def remove_prefix(self, guild_id: int, prefix: str):
-        await self.bot.pool.execute("UPDATE guild_info SET prefixes = array_remove(prefixes, $1) WHERE guild_id = $2", prefix, guild_id)
         (await self.get_guild_info(guild_id))["prefixes"].remove(prefix)
+        self.mark_guild_dirty(guild_id)
+        matcher = self.prefix_matchers[guild_id]
+        if prefix in matcher.prefixes:
+            matcher.remove(prefix)
+            self.unindex_prefixes([prefix])
 
         await self.cleanup_guild_info(guild_id)
 
     async def clear_prefixes(self, guild_id: int):
-        await self.bot.pool.execute("UPDATE guild_info SET prefixes = '{}' WHERE guild_id = $1", guild_id)
         (await self.get_guild_info(guild_id))["prefixes"].clear()
+        self.mark_guild_dirty(guild_id)
+        self.unindex_prefixes(self.prefix_matchers[guild_id].prefixes)
+        self.prefix_matchers[guild_id].clear()
 
         await self.cleanup_guild_info(guild_id)
 
     # command stats
 
     async def load_cmd_stats(self):
-        top_cmds_today = await self.bot.redis.hgetall("top_commands_today", encoding="utf-8")
-        top_users_today = await self.bot.redis.hgetall("top_users_today", encoding="utf-8")
-        top_cmds_overall = await self.bot.redis.hgetall("top_commands_overall", encoding="utf-8")
-        top_users_overall = await self.bot.redis.hgetall("top_users_overall", encoding="utf-8")
-        self.command_stats["top_commands_today"].update({k: int(v) for k, v in top_cmds_today.items()})
-        self.command_stats["top_users_today"].update({k: int(v) for k, v in top_users_today.items()})
-        self.command_stats["top_commands_overall"].update({k: int(v) for k, v in top_cmds_overall.items()})
-        self.command_stats["top_users_overall"].update({k: int(v) for k, v in top_users_overall.items()})
+        # older versions stored the stats as hashes, convert them to sorted sets once
+        pipe = self.bot.redis.pipeline()
+        types = [pipe.type(key) for key in COMMAND_STATS_KEYS]
+        await pipe.execute()
+        for key, type_ in zip(COMMAND_STATS_KEYS, types):
+            if await type_ != b"hash":
+                continue
+            data = await self.bot.redis.hgetall(key, encoding="utf-8")
+            tr = self.bot.redis.multi_exec()
+            tr.delete(key)
+            for member, score in data.items():
+                tr.zadd(key, int(score), member)
+            await tr.execute()
 
     async def dump_cmd_stats(self):
-        top_cmds_today = dict(self.command_stats["top_commands_today"])
-        top_users_today = dict(self.command_stats["top_users_today"])
-        top_cmds_overall = dict(self.command_stats["top_commands_overall"])
-        top_users_overall = dict(self.command_stats["top_users_overall"])
-        if top_cmds_today:  # will error if it's empty
-            await self.bot.redis.hmset_dict("top_commands_today", top_cmds_today)
-        if top_users_today:
-            await self.bot.redis.hmset_dict("top_users_today", top_users_today)
-        if top_cmds_overall:
-            await self.bot.redis.hmset_dict("top_commands_overall", top_cmds_overall)
-        if top_users_overall:
-            await self.bot.redis.hmset_dict("top_users_overall", top_users_overall)
+        """
+        Sends the increments collected since the last dump to redis in one pipeline.
+        """
+        pending, self.command_stats = self.command_stats, {key: Counter() for key in COMMAND_STATS_KEYS}
+        if not any(pending.values()):
+            return
+        pipe = self.bot.redis.pipeline()
+        for key, counter in pending.items():
+            for member, amount in counter.items():
+                pipe.zincrby(key, amount, member)
+        try:
+            await pipe.execute()
+        except Exception:
+            for key, counter in pending.items():  # keep them for the next dump
+                self.command_stats[key].update(counter)
+            raise
+
+    async def get_top_stats(self, *keys: str, limit: int = 5):
+        """
+        Returns the top `limit` (member, uses) pairs for each key.
+        Only reads from redis, so the increments of the last few minutes show up after the next dump.
+        """
+        pipe = self.bot.redis.pipeline()
+        futures = [pipe.zrevrange(key, 0, limit - 1, withscores=True, encoding="utf-8") for key in keys]
+        await pipe.execute()
+        return [[(member, int(score)) for member, score in await future] for future in futures]
+
+    async def load_cmd_latencies(self):
+        data = await self.bot.redis.hgetall("command_latencies")
+        for name, histogram in data.items():
+            self.command_latencies[name.decode("utf-8")].merge(LatencyHistogram.from_bytes(histogram))
+        self.command_latencies_loaded = True
+
+    async def dump_cmd_latencies(self):
+        if self.command_latencies_loaded and self.command_latencies:  # will error if it's empty
+            await self.bot.redis.hmset_dict(
+                "command_latencies", {name: histogram.to_bytes() for name, histogram in self.command_latencies.items()})
+
+    # image results
+
+    @staticmethod
+    def image_result_key(source: str, method: str, args: tuple, kwargs: dict):
+        """
+        Content address of a filter result. `source` has to identify the exact input image, e.g. its hash.
+        Only deterministic filters can be cached, a random one would give the same result every time.
+        """
+        return hashlib.sha256(repr((source, method, args, sorted(kwargs.items()))).encode("utf-8")).hexdigest()
+
+    # both tiers are best-effort, a redis error is treated as a miss and never reaches the command
+
+    async def get_image_result(self, key: str):
+        png = self.image_results.get(key)
+        if png is not None:
+            self.image_result_stats["memory hits"] += 1
+            return png
+        if self.image_results_redis:
+            try:
+                png = await self.bot.redis.get(f"image_result:{key}")
+            except Exception:
+                log.exception("Reading an image result from redis failed")
+            if png is not None:
+                self.image_results[key] = png
+                self.image_result_stats["redis hits"] += 1
+                return png
+        self.image_result_stats["misses"] += 1
+        return None
+
+    async def store_image_result(self, key: str, png: bytes):
+        if len(png) > IMAGE_RESULT_MAX_SIZE:
+            return
+        self.image_results[key] = png
+        if self.image_results_redis:
+            try:
+                await self.bot.redis.set(f"image_result:{key}", png, expire=IMAGE_RESULT_REDIS_TTL)
+            except Exception:
+                log.exception("Writing an image result to redis failed")
+
+    @property
+    def image_result_hit_rate(self):
+        total = sum(self.image_result_stats.values())
+        return (total - self.image_result_stats["misses"]) / total if total else 0.0
+
+    # socketstats
+
+    def record_socket_event(self, event: str):
+        self.socketstats[event] += 1
+        self.socketstats_pending[event] += 1
+        self.socket_rates.add(event)
+
+    async def load_socketstats(self):
+        data = await self.bot.redis.hgetall("socketstats", encoding="utf-8")
+        # anything already flushed this run is in redis, so only the pending increments need adding back
+        self.socketstats = Counter({event: int(total) for event, total in data.items()})
+        self.socketstats.update(self.socketstats_pending)
+
+    async def dump_socketstats(self):
+        pending, self.socketstats_pending = self.socketstats_pending, Counter()
+        if not pending:
+            return
+        pipe = self.bot.redis.pipeline()
+        for event, amount in pending.items():
+            pipe.hincrby("socketstats", event, amount)
+        try:
+            await pipe.execute()
+        except Exception:
+            self.socketstats_pending.update(pending)  # keep them for the next dump
+            raise
 
     async def clear_cmd_stats(self):
+        await self.dump_cmd_stats()
+
+        # take today's stats and clear them atomically, other processes may still be writing to them
+        tr = self.bot.redis.multi_exec()
+        cmds_future = tr.zrevrange("top_commands_today", 0, -1, withscores=True, encoding="utf-8")
+        users_future = tr.zrevrange("top_users_today", 0, -1, withscores=True, encoding="utf-8")
+        tr.delete("top_commands_today", "top_users_today")
+        await tr.execute()
+
         # dump
         yesterday = datetime.date.today() - datetime.timedelta(days=1)
-        cmds = json.dumps(dict(self.command_stats["top_commands_today"]))
-        users = json.dumps(dict(self.command_stats["top_users_today"]))
+        cmds = json.dumps({member: int(score) for member, score in await cmds_future})
+        users = json.dumps({member: int(score) for member, score in await users_future})
         await self.bot.pool.execute("INSERT INTO command_stats VALUES ($1, $2, $3)", yesterday, cmds, users)
 
-        # clear
-        self.command_stats["top_commands_today"].clear()
-        self.command_stats["top_users_today"].clear()
-
     # blacklist
 
     async def load_blacklist(self):
-        self.blacklist = [entry["user_id"] for entry in await self.bot.pool.fetch("SELECT user_id FROM blacklisted_users")]
+        self.blacklist = {entry["user_id"] async for entry in self.stream("SELECT user_id FROM blacklisted_users")}
 
     # async def dump_blacklist(self):
     #     pass
 
     async def add_blacklist(self, user_id: int, *, reason: str):
         await self.bot.pool.execute("INSERT INTO blacklisted_users VALUES ($1, $2)", user_id, reason)
-        self.blacklist.append(user_id)
+        self.blacklist.add(user_id)
 
     async def remove_blacklist(self, user_id: int):
         await self.bot.pool.execute("DELETE FROM blacklisted_users WHERE user_id = $1", user_id)
-        self.blacklist.remove(user_id)
+        self.blacklist.discard(user_id)
 
     async def is_blacklisted(self, user_id: int):
         return user_id in self.blacklist
 
     # todos
 
-    async def load_todos(self):
-        data = await self.bot.pool.fetch("SELECT * FROM todos")
-        for entry in data:
-            self.todos[entry["user_id"]] = entry["tasks"]
+    async def get_todo_page(self, user_id: int, *, after: int = None, limit: int):
+        if after is None:
+            return await self.bot.pool.fetch(
+                "SELECT position, task FROM todo_tasks WHERE user_id = $1 ORDER BY position LIMIT $2", user_id, limit)
+        return await self.bot.pool.fetch(
+            "SELECT position, task FROM todo_tasks WHERE user_id = $1 AND position > $2 ORDER BY position LIMIT $3",
+            user_id, after, limit)
+
+    async def count_todos(self, user_id: int):
+        return await self.bot.pool.fetchval("SELECT count(*) FROM todo_tasks WHERE user_id = $1", user_id)
+
+    async def get_todo_by_number(self, user_id: int, number: int):
+        """
+        Returns the task shown as `number` in the user's todo list, or None.
+        """
+        if number < 1:
+            return None
+        return await self.bot.pool.fetchrow(
+            "SELECT position, task FROM todo_tasks WHERE user_id = $1 ORDER BY position OFFSET $2 LIMIT 1",
+            user_id, number - 1)
 
-    async def dump_todos(self):
-        items = deepcopy(self.todos).items()
-        for user_id, tasks_ in items:
-            await self.bot.pool.execute("UPDATE todos SET tasks = $1 WHERE user_id = $2", tasks_, user_id)
+    async def add_todo(self, user_id: int, task: str):
+        """
+        Returns False if the task is already in the user's todo list.
+        """
+        for attempt in range(TODO_INSERT_ATTEMPTS):
+            try:
+                # only duplicate tasks are ignored, a taken position raises
+                status = await self.bot.pool.execute(
+                    """INSERT INTO todo_tasks (user_id, position, task)
+                    SELECT $1, COALESCE(MAX(position), 0) + 1, $2 FROM todo_tasks WHERE user_id = $1
+                    ON CONFLICT (user_id, task) DO NOTHING""", user_id, task)
+            except asyncpg.UniqueViolationError:
+                if attempt == TODO_INSERT_ATTEMPTS - 1:
+                    raise
+                continue  # another task was added at the same time and took the position, try the next one
+            return status != "INSERT 0 0"
 
-    async def create_todo(self, user_id: int):
-        await self.bot.pool.execute("INSERT INTO todos VALUES ($1)", user_id)
-        self.todos[user_id] = []
-        return self.todos[user_id]
+    async def remove_todo(self, user_id: int, task: str):
+        """
+        Returns False if the task isn't in the user's todo list.
+        """
+        status = await self.bot.pool.execute("DELETE FROM todo_tasks WHERE user_id = $1 AND task = $2", user_id, task)
+        return status != "DELETE 0"
 
-    async def delete_todo(self, user_id: int):
-        await self.bot.pool.execute("DELETE FROM todos WHERE user_id = $1", user_id)
-        self.todos.pop(user_id)
+    async def remove_todo_at(self, user_id: int, position: int):
+        await self.bot.pool.execute("DELETE FROM todo_tasks WHERE user_id = $1 AND position = $2", user_id, position)
 
-    async def get_todo(self, user_id: int):
-        return self.todos.get(user_id, None)
+    async def clear_todos(self, user_id: int):
+        await self.bot.pool.execute("DELETE FROM todo_tasks WHERE user_id = $1", user_id)
 
-    async def cleanup_todo(self, user_id: int):
-        todo = await self.get_todo(user_id)
-        if not todo:
-            await self.delete_todo(user_id)
 
-    async def add_todo(self, user_id: int, task: str):
-        await self.bot.pool.execute("UPDATE todos SET tasks = array_append(tasks, $1) WHERE user_id = $2", task, user_id)
-        (await self.get_todo(user_id)).append(task)
+class Timer:
+    """
+    A timer stored in the database. When it expires, `on_<event>_timer_complete` is dispatched with the timer.
+    """
+    __slots__ = ("id", "event", "expires", "created", "extra")
 
-    async def remove_todo(self, user_id: int, task: str):
-        await self.bot.pool.execute("UPDATE todos SET tasks = array_remove(tasks, $1) WHERE user_id = $2", task, user_id)
-        (await self.get_todo(user_id)).remove(task)
+    def __init__(self, record: asyncpg.Record):
+        self.id = record["id"]
+        self.event = record["event"]
+        self.expires = record["expires"]
+        self.created = record["created"]
+        self.extra = json.loads(record["extra"])
 
-        await self.cleanup_todo(user_id)
+    def __lt__(self, other):
+        return (self.expires, self.id) < (other.expires, other.id)
 
-    async def clear_todos(self, user_id: int):
-        await self.bot.pool.execute("UPDATE todos SET tasks = '{}' WHERE user_id = $1", user_id)
-        (await self.get_todo(user_id)).clear()
 
-        await self.cleanup_todo(user_id)
+class TimerManager:
+    """
+    Dispatches timers from the database with a single task.
+    Only the nearest timers are held in memory, in a min-heap. Every pending timer that expires at or before
+    `horizon` is guaranteed to be in the heap, the rest are fetched once the heap runs dry.
+    """
+    def __init__(self, bot: PB_Bot, *, window: int = TIMER_WINDOW):
+        self.bot = bot
+        self.window = window
+        self.heap = []
+        self.horizon = None  # None means that every pending timer is in the heap
+        self.loaded = False
+        self.created = []  # timers created while the heap is being refilled
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+    def start(self):
+        self.task = self.bot.loop.create_task(self.dispatch_timers())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+
+    async def create_timer(self, event: str, expires: datetime.datetime, **extra):
+        record = await self.bot.pool.fetchrow(
+            "INSERT INTO timers (event, expires, extra) VALUES ($1, $2, $3) RETURNING *",
+            event, expires, json.dumps(extra))
+        timer = Timer(record)
+        if not self.loaded:
+            self.created.append(timer)
+        elif self.horizon is None or timer.expires <= self.horizon:
+            heapq.heappush(self.heap, timer)
+            if len(self.heap) > 2 * self.window:
+                self.trim()
+            self.wakeup.set()
+        return timer
+
+    def trim(self):
+        self.heap = heapq.nsmallest(self.window, self.heap)  # a sorted list is still a heap
+        self.horizon = self.heap[-1].expires
+
+    async def refill(self):
+        self.loaded = False
+        self.created = []
+        records = await self.bot.pool.fetch("SELECT * FROM timers ORDER BY expires LIMIT $1", self.window)
+        timers = {record["id"]: Timer(record) for record in records}
+        horizon = records[-1]["expires"] if len(records) == self.window else None
+        # timers created during the fetch may or may not be in the rows
+        for timer in self.created:
+            if horizon is None or timer.expires <= horizon:
+                timers.setdefault(timer.id, timer)
+        self.heap = sorted(timers.values())
+        self.horizon = horizon
+        self.created = []
+        self.loaded = True
+
+    async def dispatch_timers(self):
+        await self.bot.wait_until_ready()
+        retry_delay = TIMER_RETRY_DELAY
+        while not self.bot.is_closed():
+            try:
+                await self.dispatch_next()
+            except Exception:
+                log.exception("Dispatching timers failed, retrying in %s seconds", retry_delay)
+                self.heap = []  # it's refilled from the database, which is the source of truth
+                self.loaded = False
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, TIMER_MAX_RETRY_DELAY)
+            else:
+                retry_delay = TIMER_RETRY_DELAY
+
+    async def dispatch_next(self):
+        """
+        Waits for the nearest timer and dispatches it if it has expired.
+        """
+        if not self.heap:
+            await self.refill()
+        if not self.heap:
+            self.wakeup.clear()
+            await self.wakeup.wait()  # create_timer wakes us up
+            return
+        timer = self.heap[0]
+        delay = (timer.expires - datetime.datetime.utcnow()).total_seconds()
+        if delay > 0:
+            self.wakeup.clear()
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self.wakeup.wait(), timeout=delay)
+            return
+        heapq.heappop(self.heap)
+        await self.bot.pool.execute("DELETE FROM timers WHERE id = $1", timer.id)
+        self.bot.dispatch(f"{timer.event}_timer_complete", timer)
+
+
+class Stall:
+    """
+    A period where the event loop was blocked, together with the stack of whatever blocked it.
+    """
+    __slots__ = ("lag", "stack", "when")
+
+    def __init__(self, lag: float, stack: typing.Optional[traceback.StackSummary]):
+        self.lag = lag
+        self.stack = stack
+        self.when = datetime.datetime.now()
+
+    @property
+    def location(self):
+        """
+        The innermost frame that belongs to the bot rather than to a library.
+        """
+        if not self.stack:
+            return "unknown"
+        cwd = os.getcwd()
+        for frame in reversed(self.stack):
+            if frame.filename.startswith(cwd) and "site-packages" not in frame.filename:
+                return f"{os.path.relpath(frame.filename, cwd)}:{frame.lineno} in {frame.name}"
+        frame = self.stack[-1]
+        return f"{frame.filename}:{frame.lineno} in {frame.name}"
+
+    def format_stack(self):
+        if not self.stack:
+            return "The stack was not captured in time."
+        return "".join(traceback.StackSummary.from_list(self.stack[-LOOP_STALL_STACK_DEPTH:]).format())
+
+
+class LoopMonitor:
+    """
+    Measures how late the event loop is at waking up a sleeping heartbeat task.
+    A watchdog thread notices when a heartbeat is overdue and captures the loop thread's stack while it is still
+    blocked, so that stalls can be traced back to the code that caused them.
+    """
+    def __init__(self, bot: PB_Bot, *, interval: float = LOOP_MONITOR_INTERVAL):
+        self.bot = bot
+        self.interval = interval
+        self.threshold = config.get("loop_stall_threshold", LOOP_STALL_THRESHOLD)
+        self.lag = LatencyHistogram()
+        self.max_lag = 0.0
+        self.stall_count = 0
+        self.stalls = deque(maxlen=LOOP_STALL_HISTORY)  # ring buffer, the oldest stalls are dropped first
+        self.last_beat = None
+        self.captured = None  # (last_beat, stack) taken by the watchdog during the current heartbeat
+        self.loop_thread_id = None
+        self.stopped = threading.Event()
+        self.task = None
+
+    def start(self):
+        self.task = self.bot.loop.create_task(self.heartbeat())
+        threading.Thread(target=self.watchdog, name="loop-monitor", daemon=True).start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.task is not None:
+            self.task.cancel()
+
+    async def heartbeat(self):
+        self.loop_thread_id = threading.get_ident()
+        while True:
+            self.last_beat = last_beat = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(time.perf_counter() - last_beat - self.interval, 0.0)
+            self.lag.record(lag)
+            self.max_lag = max(self.max_lag, lag)
+            if lag >= self.threshold:
+                self.stall_count += 1
+                captured = self.captured
+                self.stalls.append(Stall(lag, captured[1] if captured and captured[0] == last_beat else None))
+
+    def watchdog(self):
+        # runs in its own thread, so it keeps going while the loop is blocked
+        while not self.stopped.wait(self.threshold / 2):
+            last_beat = self.last_beat
+            if last_beat is None or (self.captured is not None and self.captured[0] == last_beat):
+                continue
+            if time.perf_counter() - last_beat > self.interval + self.threshold:
+                frame = sys._current_frames().get(self.loop_thread_id)
+                if frame is not None:
+                    self.captured = (last_beat, traceback.extract_stack(frame))
+
+    def worst_stalls(self):
+        return sorted(self.stalls, key=lambda stall: stall.lag, reverse=True)
+
+    def stats(self):
+        return {
+            "p50": f"{self.lag.percentile(50) * 1000:.2f}ms",
+            "p99": f"{self.lag.percentile(99) * 1000:.2f}ms",
+            "max": f"{self.max_lag * 1000:.2f}ms",
+            "threshold": f"{self.threshold * 1000:.0f}ms",
+            "stalls": f"{self.stall_count:,}",
+        }
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler. While running, a thread samples the stack of every other thread and counts the stacks in
+    collapsed-stack format. Samples from the event loop thread are tagged with the command that was running.
+    """
+    def __init__(self, bot: PB_Bot):
+        self.bot = bot
+        self.rate = config.get("profiler_rate", PROFILER_RATE)
+        self.running = False
+        self.labels = {}  # code object -> frame label
+
+    async def profile(self, seconds: float):
+        """
+        Profiles the bot for `seconds` and returns a Counter of collapsed stacks.
+        """
+        self.running = True
+        stacks = Counter()
+        stopped = threading.Event()
+        thread = threading.Thread(
+            target=self.run_sampler, args=(threading.get_ident(), stacks, stopped), name="profiler", daemon=True)
+        thread.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            stopped.set()
+            while thread.is_alive():
+                await asyncio.sleep(1 / self.rate)
+            self.running = False
+        return stacks
+
+    def run_sampler(self, loop_thread_id: int, stacks: Counter, stopped: threading.Event):
+        while not stopped.wait(1 / self.rate):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                name = names.get(thread_id, str(thread_id))
+                if name in PROFILER_IGNORED_THREADS:
+                    continue
+                if thread_id == loop_thread_id:
+                    task = asyncio.tasks._current_tasks.get(self.bot.loop)
+                    tag = "idle" if task is None else self.bot.command_tasks.get(task, "other tasks")
+                    name = f"event loop;{tag}"
+                elif frame.f_code.co_name == "_worker" and frame.f_code.co_filename.endswith(EXECUTOR_WORKER_FILE):
+                    continue  # an executor thread waiting for work
+                stacks[f"{name};{self.collapse(frame)}"] += 1
+
+    def collapse(self, frame):
+        labels = []
+        while frame is not None:
+            code = frame.f_code
+            label = self.labels.get(code)
+            if label is None:
+                label = self.labels[code] = f"{code.co_name} ({short_path(code.co_filename)})"
+            labels.append(label)
+            frame = frame.f_back
+        return ";".join(reversed(labels))
+
+
+class TracedPool:
+    """
+    Wraps an asyncpg pool so that every query made through it is traced.
+    """
+    def __init__(self, pool: asyncpg.pool.Pool):
+        self.pool = pool
+
+    def __getattr__(self, item):
+        return getattr(self.pool, item)
+
+    async def execute(self, query: str, *args, **kwargs):
+        with trace("postgresql execute", query=query):
+            return await self.pool.execute(query, *args, **kwargs)
+
+    async def executemany(self, command: str, args, **kwargs):
+        with trace("postgresql executemany", query=command, rows=len(args)):
+            return await self.pool.executemany(command, args, **kwargs)
+
+    async def fetch(self, query: str, *args, **kwargs):
+        with trace("postgresql fetch", query=query) as span:
+            records = await self.pool.fetch(query, *args, **kwargs)
+            if span is not None:
+                span.attributes["rows"] = len(records)
+            return records
+
+    async def fetchrow(self, query: str, *args, **kwargs):
+        with trace("postgresql fetchrow", query=query):
+            return await self.pool.fetchrow(query, *args, **kwargs)
+
+    async def fetchval(self, query: str, *args, **kwargs):
+        with trace("postgresql fetchval", query=query):
+            return await self.pool.fetchval(query, *args, **kwargs)
+
+
+class Tracer:
+    """
+    Traces a sample of the command invocations and appends every span of them to a JSON-lines file.
+    Database queries, redis commands, HTTP requests, discord API calls and executor jobs made while a traced command
+    is running become spans of it automatically.
+    """
+    def __init__(self, bot: PB_Bot):
+        self.bot = bot
+        self.sample_rate = config.get("trace_sample_rate", TRACE_SAMPLE_RATE)
+        self.path = config.get("trace_path", TRACE_PATH)
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def trace_command(self, ctx):
+        if active_span() is not None or random.random() >= self.sample_rate:
+            yield None
+            return
+        root = Span(f"command {ctx.command.qualified_name}", command=ctx.command.qualified_name,
+                    user_id=ctx.author.id, guild_id=ctx.guild.id if ctx.guild else None)
+        token = current_span.set(root)
+        try:
+            yield root
+        finally:
+            root.finish()
+            current_span.reset(token)
+            self.bot.loop.run_in_executor(None, self.export, [span.to_dict() for span in root.spans])
+
+    def export(self, spans: list):
+        lines = "".join(f"{json.dumps(span, default=str)}\n" for span in spans)
+        with self.lock, open(self.path, "a") as f:
+            f.write(lines)
+
+    # instrumentation
+
+    def instrument(self):
+        self.instrument_redis()
+        self.instrument_executor()
+        self.instrument_discord()
+
+    def instrument_redis(self):
+        execute = self.bot.redis.execute
+
+        def traced_execute(command, *args, **kwargs):
+            span = start_span(f"redis {command.decode() if isinstance(command, bytes) else command}")
+            future = asyncio.ensure_future(execute(command, *args, **kwargs))
+            if span is not None:
+                future.add_done_callback(lambda _: span.finish())
+            return future
+
+        self.bot.redis.execute = traced_execute
+
+    def instrument_executor(self):
+        run_in_executor = self.bot.loop.run_in_executor
+
+        def traced_run_in_executor(executor, func, *args):
+            function = func.func if isinstance(func, functools.partial) else func
+            span = start_span(f"executor {getattr(executor, 'name', 'default')}",
+                              function=getattr(function, "__qualname__", repr(function)))
+            if span is None:
+                return run_in_executor(executor, func, *args)
+            if getattr(executor, "kind", "thread") == "process":  # the wrapper below can't be pickled
+                future = run_in_executor(executor, func, *args)
+                future.add_done_callback(lambda _: span.finish())
+                return future
+
+            def run():
+                span.attributes["queued_ms"] = (time.perf_counter() - span.stopwatch.start_time) * 1000
+                return func(*args)
+
+            future = run_in_executor(executor, run)
+            future.add_done_callback(lambda _: span.finish())
+            return future
+
+        self.bot.loop.run_in_executor = traced_run_in_executor
+
+    def instrument_discord(self):
+        request = self.bot.http.request
+
+        async def traced_request(route, **kwargs):
+            with trace(f"discord {route.method} {route.path}"):
+                return await request(route, **kwargs)
+
+        self.bot.http.request = traced_request
+
+    @staticmethod
+    def http_trace_config():
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_request_start(session, context, params):
+            context.span = start_span(f"http {params.method}", url=f"{params.url.host}{params.url.path}")
+
+        async def on_request_end(session, context, params):
+            if context.span is not None:
+                context.span.attributes["status"] = params.response.status
+                context.span.finish()
+
+        async def on_request_exception(session, context, params):
+            if context.span is not None:
+                context.span.attributes["error"] = repr(params.exception)
+                context.span.finish()
+
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_request_end.append(on_request_end)
+        trace_config.on_request_exception.append(on_request_exception)
+        return trace_config
+
+
+class LatencyProber:
+    """
+    Samples the latency of every service the bot talks to on an interval, so that commands can show a summary of
+    the recent samples instead of waiting on one noisy measurement of their own.
+    """
+    def __init__(self, bot: PB_Bot):
+        self.bot = bot
+        self.interval = config.get("probe_interval", PROBE_INTERVAL)
+        self.probes = {
+            "REST API": bot.rest_ping,
+            "PostgreSQL": bot.postgresql_ping,
+            "Redis": bot.redis_ping,
+            "Lavalink": bot.lavalink_ping,
+        }
+        self.samples = {name: deque(maxlen=PROBE_HISTORY) for name in self.probes}
+        self.failures = Counter()
+        self.task = None
+
+    def start(self):
+        self.task = self.bot.loop.create_task(self.run_probes())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+
+    async def run_probes(self):
+        await self.bot.wait_until_ready()
+        while not self.bot.is_closed():
+            await self.probe()
+            await asyncio.sleep(self.interval)
+
+    async def probe(self):
+        """
+        Runs every probe at the same time and records the results.
+        """
+        results = await asyncio.gather(
+            *(asyncio.wait_for(probe(), timeout=PROBE_TIMEOUT) for probe in self.probes.values()),
+            return_exceptions=True)
+        for name, result in zip(self.probes, results):
+            if isinstance(result, Exception):
+                self.failures[name] += 1
+            elif result is not None:  # None means the service isn't set up
+                self.samples[name].append(result)
+
+    def summary(self, name: str):
+        """
+        Returns the min, median and p99 of the recent samples, in seconds, or None if there aren't any.
+        """
+        samples = sorted(self.samples[name])
+        if not samples:
+            return None
+        return {
+            "min": samples[0],
+            "median": statistics.median(samples),
+            "p99": samples[math.ceil(len(samples) * 0.99) - 1],
+        }
+
+    def summaries(self):
+        return {name: summary for name in self.probes if (summary := self.summary(name)) is not None}
+
+
+class ResourceSample:
+    __slots__ = ("when", "cpu", "rss", "uss", "vms", "threads", "fds", "gc_collections", "tasks")
+
+    def __init__(self, process: psutil.Process, loop: asyncio.AbstractEventLoop):
+        self.when = datetime.datetime.now()
+        with process.oneshot():
+            memory = process.memory_full_info()
+            self.cpu = process.cpu_percent()  # since the previous sample
+            self.threads = process.num_threads()
+            self.fds = process.num_fds() if hasattr(process, "num_fds") else process.num_handles()
+        self.rss = memory.rss
+        self.uss = memory.uss
+        self.vms = memory.vms
+        self.gc_collections = tuple(generation["collections"] for generation in gc.get_stats())
+        self.tasks = len(asyncio.all_tasks(loop))
+
+
+class ResourceSampler:
+    """
+    Samples the process' resource usage from a thread, so that reading /proc never blocks the event loop and
+    the cpu usage is measured over a whole interval instead of a single call.
+    """
+    def __init__(self, bot: PB_Bot):
+        self.bot = bot
+        self.interval = config.get("resource_sample_interval", RESOURCE_SAMPLE_INTERVAL)
+        self.process = psutil.Process()
+        self.samples = deque(maxlen=RESOURCE_HISTORY)
+        self.stopped = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self.run_sampler, name="resource-sampler", daemon=True).start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run_sampler(self):
+        with suppress(psutil.Error):
+            self.process.cpu_percent()  # the first call always returns 0
+        while not self.stopped.wait(self.interval):
+            try:
+                self.samples.append(ResourceSample(self.process, self.bot.loop))
+            except Exception:  # e.g. psutil.AccessDenied, the thread has to keep going
+                log.exception("Sampling the process' resources failed")
+
+    @property
+    def latest(self):
+        return self.samples[-1] if self.samples else None
+
+    def average_cpu(self, seconds: float):
+        samples = list(self.samples)[-max(int(seconds // self.interval), 1):]
+        return sum(sample.cpu for sample in samples) / len(samples) if samples else 0.0
 
 
 class CustomContext(commands.Context):
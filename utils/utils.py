@@ -5,12 +5,28 @@ from discord.ext import commands
 import datetime
 import time
 import random
-from collections import deque
+from collections import deque, OrderedDict, Counter
 import asyncio
 import dateparser
 import humanize
 import typing
 import textwrap
+import difflib
+import inspect
+import math
+import struct
+import sys
+import os
+import types
+import html
+import zlib
+import contextvars
+import threading
+import concurrent.futures
+import multiprocessing
+from contextlib import contextmanager
+import tracemalloc
+from array import array
 
 
 # helper functions
@@ -27,6 +43,110 @@ def padding(d: dict, *, separator: str):
     return "\n".join(f"{k.rjust(len(max(d.keys(), key=len)))}{separator}{v}" for k, v in d.items())
 
 
+def sparkline(values: list):
+    """
+    Draws a list of numbers as a one line bar chart.
+    """
+    bars = "▁▂▃▄▅▆▇█"
+    if not values:
+        return ""
+    low, high = min(values), max(values)
+    if low == high:
+        return bars[0] * len(values)
+    return "".join(bars[int((value - low) / (high - low) * (len(bars) - 1))] for value in values)
+
+
+def deep_sizeof(obj, *, exclude: tuple = (), sample: int = 1000):
+    """
+    Approximates the memory used by an object and everything it references, except instances of `exclude`.
+    Containers with more than `sample` items are measured from a random sample of their items, at every level.
+    """
+    ignored = (type, types.ModuleType, types.FunctionType, types.MethodType, types.BuiltinFunctionType) + exclude
+    seen = set()
+    size = 0
+    stack = [(obj, 1)]  # (object, how many objects like it it stands for)
+    while stack:
+        obj, weight = stack.pop()
+        if id(obj) in seen or isinstance(obj, ignored):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj) * weight
+        if isinstance(obj, (str, bytes, bytearray, int, float, array)):
+            continue
+        if isinstance(obj, (dict, list, tuple, set, frozenset, deque)):
+            items = list(obj.items()) if isinstance(obj, dict) else list(obj)
+            if len(items) > sample:
+                items = random.sample(items, sample)
+            item_weight = weight * len(obj) / len(items) if items else weight
+            if isinstance(obj, dict):
+                stack.extend((item, item_weight) for pair in items for item in pair)
+            else:
+                stack.extend((item, item_weight) for item in items)
+        if hasattr(obj, "__dict__"):
+            stack.append((obj.__dict__, weight))
+        for cls in type(obj).__mro__:
+            for slot in cls.__dict__.get("__slots__", ()):
+                if hasattr(obj, slot) and slot != "__dict__":
+                    stack.append((getattr(obj, slot), weight))
+    return int(size)
+
+
+def short_path(filename: str):
+    """
+    Shortens a file path to be relative to the bot's directory or to site-packages.
+    """
+    if "site-packages" in filename:
+        return filename.split("site-packages")[-1].lstrip(os.sep)
+    if filename.startswith(os.getcwd()):
+        return os.path.relpath(filename)
+    return filename
+
+
+def flame_graph(stacks: Counter, *, title: str, width: int = 1200, row_height: int = 16):
+    """
+    Renders collapsed stacks as a flame graph SVG. Hovering over a frame shows its full name and sample count.
+    """
+    root = {"count": 0, "children": {}}
+    for stack, count in stacks.items():
+        node = root
+        node["count"] += count
+        for frame in stack.split(";"):
+            node = node["children"].setdefault(frame, {"count": 0, "children": {}})
+            node["count"] += count
+
+    rects = []
+    depth = 0
+    todo = [(root, 0, 0.0)]
+    while todo:
+        node, level, x = todo.pop()
+        depth = max(depth, level)
+        for name, child in sorted(node["children"].items()):
+            child_width = child["count"] / max(root["count"], 1) * width
+            if child_width >= 0.1:
+                rects.append((name, child["count"], level, x, child_width))
+                todo.append((child, level + 1, x))
+            x += child_width
+
+    top = 2 * row_height
+    height = top + (depth + 1) * row_height
+    elements = []
+    for name, count, level, x, rect_width in rects:
+        y = height - (level + 1) * row_height
+        colour = zlib.crc32(name.encode())  # same frame, same colour
+        fill = f"rgb({205 + colour % 50},{(colour >> 8) % 230},{(colour >> 16) % 55})"
+        label = name if len(name) * 7 < rect_width else name[:max(int(rect_width // 7) - 2, 0)] + ".."
+        elements.append(
+            f'<g><title>{html.escape(name)} ({count:,} samples, {count / root["count"]:.2%})</title>'
+            f'<rect x="{x:.1f}" y="{y}" width="{rect_width:.1f}" height="{row_height - 1}" fill="{fill}"/>'
+            + (f'<text x="{x + 3:.1f}" y="{y + row_height - 4}">{html.escape(label)}</text>' if rect_width > 21 else "")
+            + "</g>")
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+            f'font-family="monospace" font-size="12">'
+            f'<rect width="100%" height="100%" fill="#f8f8f8"/>'
+            f'<text x="{width / 2}" y="{row_height}" text-anchor="middle" font-size="16">{html.escape(title)}</text>'
+            + "".join(elements) + "</svg>")
+
+
 def humanize_list(li: list):
     """
     "Humanizes" a list.
@@ -65,9 +185,681 @@ class StopWatch:
         return self.end_time - self.start_time
 
 
+current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """
+    A timed operation in a trace. Every span in a trace shares the root's `spans` list.
+    """
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "attributes", "started_at", "stopwatch", "spans")
+
+    def __init__(self, name: str, *, parent: "Span" = None, **attributes):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else f"{random.getrandbits(64):016x}"
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = attributes
+        self.started_at = time.time()
+        self.stopwatch = StopWatch()
+        self.stopwatch.start()
+        self.spans = parent.spans if parent else []
+        self.spans.append(self)
+
+    def child(self, name: str, **attributes):
+        return Span(name, parent=self, **attributes)
+
+    def finish(self):
+        if self.stopwatch.end_time is None:
+            self.stopwatch.stop()
+
+    @property
+    def trace_finished(self):
+        """
+        Whether the root span has finished, after which the trace has been exported and takes no more spans.
+        """
+        return self.spans[0].stopwatch.end_time is not None
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.started_at,
+            "duration_ms": self.stopwatch.elapsed * 1000 if self.stopwatch.end_time is not None else None,
+            "attributes": self.attributes,
+        }
+
+
+def active_span():
+    """
+    Returns the current span, or None if there isn't one or its trace has finished. Tasks created during a traced
+    command copy the context, so they can outlive the trace while still seeing one of its spans.
+    """
+    span = current_span.get()
+    return span if span is not None and not span.trace_finished else None
+
+
+@contextmanager
+def trace(name: str, **attributes):
+    """
+    Times the block as a child of the current span, and makes it the current span so that anything traced inside
+    of it nests under it. Does nothing outside of a sampled trace.
+    """
+    parent = active_span()
+    if parent is None:
+        yield None
+        return
+    span = parent.child(name, **attributes)
+    token = current_span.set(span)
+    try:
+        yield span
+    finally:
+        span.finish()
+        current_span.reset(token)
+
+
+def start_span(name: str, **attributes):
+    """
+    Starts a child of the current span without making it current, for operations that finish in a callback.
+    The caller has to finish it. Returns None outside of a sampled trace.
+    """
+    parent = active_span()
+    return parent.child(name, **attributes) if parent is not None else None
+
+
+class PrefixMatcher:
+    """
+    Matches a message against a set of prefixes with a single compiled regex.
+    Longer prefixes are tried first so that `pb` wins over `p`.
+    """
+    __slots__ = ("prefixes", "pattern")
+
+    def __init__(self, prefixes: typing.Iterable[str] = ()):
+        self.prefixes = []
+        self.pattern = None
+        for prefix in prefixes:
+            if prefix not in self.prefixes:
+                self.prefixes.append(prefix)
+        self.rebuild()
+
+    def rebuild(self):
+        if not self.prefixes:
+            self.pattern = None
+            return
+        alternation = "|".join(re.escape(prefix) for prefix in sorted(self.prefixes, key=len, reverse=True))
+        self.pattern = re.compile(rf"(?:{alternation})\s*", flags=re.IGNORECASE)
+
+    def add(self, prefix: str):
+        if prefix not in self.prefixes:
+            self.prefixes.append(prefix)
+            self.rebuild()
+
+    def remove(self, prefix: str):
+        if prefix in self.prefixes:
+            self.prefixes.remove(prefix)
+            self.rebuild()
+
+    def clear(self):
+        self.prefixes.clear()
+        self.rebuild()
+
+    def match(self, content: str):
+        """
+        Returns the matched prefix (including trailing whitespace) or None.
+        """
+        if self.pattern is None:
+            return None
+        match = self.pattern.match(content)
+        return match.group(0) if match else None
+
+
+class LRUCache:
+    """
+    Size-bounded mapping that evicts the least recently used key first and expires keys after `ttl` seconds.
+    Keys for which `can_evict` returns False are never evicted or expired.
+    If `weigher` is given, `maxsize` is a budget for the total weight of the values instead of a number of keys.
+    """
+    def __init__(self, maxsize: int, *, ttl: float = None, on_evict: typing.Callable = None,
+                 can_evict: typing.Callable = None, weigher: typing.Callable = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.can_evict = can_evict or (lambda key: True)
+        self.weigher = weigher
+        self.weight = 0
+        self._data = OrderedDict()  # key -> (value, expires_at)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __setitem__(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        if self.weigher is not None:
+            if key in self._data:
+                self.weight -= self.weigher(self._data[key][0])
+            self.weight += self.weigher(value)
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        self._shrink()
+
+    @property
+    def size(self):
+        return self.weight if self.weigher is not None else len(self._data)
+
+    def _remove(self, key):
+        value, _ = self._data.pop(key)
+        if self.weigher is not None:
+            self.weight -= self.weigher(value)
+        return value
+
+    def _evict(self, key):
+        value = self._remove(key)
+        if self.on_evict is not None:
+            self.on_evict(key, value)
+
+    def _shrink(self):
+        skipped = 0  # keys in a row that couldn't be evicted
+        while self.size > self.maxsize and skipped < len(self._data):
+            key = next(iter(self._data))
+            if self.can_evict(key):
+                self._evict(key)
+                self.evictions += 1
+                skipped = 0
+            else:
+                self._data.move_to_end(key)  # out of the way of the next eviction
+                skipped += 1
+
+    def get(self, key, default=None):
+        try:
+            value, expires_at = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        if expires_at is not None and expires_at < time.monotonic() and self.can_evict(key):
+            self._evict(key)
+            self.expirations += 1
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def peek(self, key, default=None):
+        """
+        Like `get`, but doesn't count towards the stats or the LRU order.
+        """
+        try:
+            return self._data[key][0]
+        except KeyError:
+            return default
+
+    def pop(self, key, default=None):
+        try:
+            return self._remove(key)
+        except KeyError:
+            return default
+
+    def items(self):
+        return [(key, value) for key, (value, _) in self._data.items()]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": f"{self.size:,}/{self.maxsize:,}",
+            **({"entries": f"{len(self._data):,}"} if self.weigher is not None else {}),
+            "hits": f"{self.hits:,}",
+            "misses": f"{self.misses:,}",
+            "hit rate": f"{self.hits / total:.2%}" if total else "n/a",
+            "evictions": f"{self.evictions:,}",
+            "expirations": f"{self.expirations:,}",
+        }
+
+
+class SuggestionIndex:
+    """
+    Trigram index for "did you mean" suggestions. Only the names sharing the most trigrams with the input are
+    compared with difflib, and results (including empty ones) for recent inputs are cached.
+    """
+    SHORTLIST_SIZE = 20
+
+    def __init__(self, names: typing.Iterable[str], *, cache_size: int = 256):
+        self.names = sorted(set(names))
+        self.grams = {}  # trigram -> names containing it
+        for name in self.names:
+            for gram in self.ngrams(name):
+                self.grams.setdefault(gram, set()).add(name)
+        self.cache = LRUCache(cache_size)
+
+    @staticmethod
+    def ngrams(text: str, n: int = 3):
+        text = f"  {text.lower()} "
+        return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+    def suggest(self, word: str):
+        """
+        Returns up to 3 close matches for `word`, best first.
+        """
+        matches = self.cache.get(word)
+        if matches is not None:
+            return matches
+        candidates = Counter()
+        for gram in self.ngrams(word):
+            candidates.update(self.grams.get(gram, ()))
+        shortlist = [name for name, _ in candidates.most_common(self.SHORTLIST_SIZE)]
+        self.cache[word] = matches = difflib.get_close_matches(word, shortlist)
+        return matches
+
+
+class CommandInfo:
+    """
+    Static information about a command, including where its source code is.
+    """
+    __slots__ = ("name", "qualified_name", "signature", "aliases", "help", "category", "filepath", "first_line",
+                 "last_line")
+
+    def __init__(self, command: typing.Union[commands.Command, commands.HelpCommand]):
+        if isinstance(command, commands.HelpCommand):
+            self.name = self.qualified_name = "help"
+            self.signature = self.help = self.category = None
+            self.aliases = command.command_attrs.get("aliases", [])
+            lines, self.first_line = inspect.getsourcelines(type(command))
+            module = command.__module__
+        else:
+            self.name = command.name
+            self.qualified_name = command.qualified_name
+            self.signature = command.signature
+            self.aliases = command.aliases
+            self.help = command.help
+            self.category = command.cog_name
+            lines, self.first_line = inspect.getsourcelines(command.callback.__code__)
+            module = command.callback.__module__
+        self.filepath = f"{module.replace('.', '/')}.py"
+        self.last_line = self.first_line + len(lines) - 1
+
+
+class CommandRegistry:
+    """
+    Holds everything about the loaded commands that only changes when commands are added or removed:
+    command info, rendered help embeds and the suggestion index. Entries are built the first time they're used
+    and everything is dropped by `clear`.
+    """
+    def __init__(self):
+        self.entries = {}
+
+    def clear(self):
+        self.entries.clear()
+
+    def memo(self, key, factory: typing.Callable):
+        try:
+            return self.entries[key]
+        except KeyError:
+            self.entries[key] = value = factory()
+            return value
+
+    def command_info(self, command: typing.Union[commands.Command, commands.HelpCommand]):
+        name = "help" if isinstance(command, commands.HelpCommand) else command.qualified_name
+        return self.memo(("info", name), lambda: CommandInfo(command))
+
+
+class LatencyHistogram:
+    """
+    Fixed-bucket latency histogram. Bucket bounds grow geometrically, so every percentile is accurate to within
+    `GROWTH` of the real value no matter how large it is (the same idea as HDR histograms).
+    """
+    MIN = 0.001  # seconds, everything faster ends up in the first bucket
+    GROWTH = 1.1
+    BUCKETS = 160  # the last bucket starts at roughly 0.001 * 1.1 ** 159 = 3800 seconds
+    HEADER = struct.Struct("<QQ")
+
+    __slots__ = ("counts", "successes", "failures")
+
+    def __init__(self):
+        self.counts = array("Q", [0]) * self.BUCKETS
+        self.successes = 0
+        self.failures = 0
+
+    @property
+    def total(self):
+        return self.successes + self.failures
+
+    def bucket(self, seconds: float):
+        if seconds <= self.MIN:
+            return 0
+        return min(int(math.log(seconds / self.MIN, self.GROWTH)) + 1, self.BUCKETS - 1)
+
+    def record(self, seconds: float, *, failed: bool = False):
+        self.counts[self.bucket(seconds)] += 1
+        if failed:
+            self.failures += 1
+        else:
+            self.successes += 1
+
+    def percentile(self, percent: float):
+        """
+        Returns the upper bound of the bucket containing the given percentile, in seconds.
+        """
+        total = self.total
+        if not total:
+            return 0.0
+        threshold = total * percent / 100
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= threshold:
+                return self.MIN * self.GROWTH ** index
+        return self.MIN * self.GROWTH ** (self.BUCKETS - 1)
+
+    def merge(self, other: "LatencyHistogram"):
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.successes += other.successes
+        self.failures += other.failures
+
+    def to_bytes(self):
+        return self.HEADER.pack(self.successes, self.failures) + self.counts.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        """
+        Returns an empty histogram if the data was written with a different bucket layout, the counts can't be
+        mapped onto the current buckets.
+        """
+        histogram = cls()
+        if len(data) != cls.HEADER.size + histogram.counts.itemsize * cls.BUCKETS:
+            return histogram
+        histogram.successes, histogram.failures = cls.HEADER.unpack_from(data)
+        histogram.counts = array("Q")
+        histogram.counts.frombytes(data[cls.HEADER.size:])
+        return histogram
+
+
+class SecondCounter:
+    """
+    Counts per second over the last `window` seconds, in a ring buffer.
+    One extra slot is kept for the second that is still in progress.
+    """
+    __slots__ = ("counts", "last_second")
+
+    def __init__(self, window: int):
+        self.counts = array("I", [0]) * (window + 1)
+        self.last_second = 0
+
+    def advance(self, second: int):
+        """
+        Zeroes the slots of the seconds that passed without any counts.
+        """
+        gap = second - self.last_second
+        if gap <= 0:
+            return
+        size = len(self.counts)
+        if gap >= size:
+            self.counts = array("I", [0]) * size
+        else:
+            start = (self.last_second + 1) % size
+            end = start + gap
+            if end <= size:
+                self.counts[start:end] = array("I", [0]) * gap
+            else:
+                self.counts[start:] = array("I", [0]) * (size - start)
+                self.counts[:end - size] = array("I", [0]) * (end - size)
+        self.last_second = second
+
+    def add(self, second: int, amount: int = 1):
+        self.advance(second)
+        self.counts[second % len(self.counts)] += amount
+
+    def total(self, second: int, seconds: int):
+        """
+        Returns the sum of the `seconds` complete seconds before `second`.
+        """
+        self.advance(second)
+        size = len(self.counts)
+        start, end = (second - seconds) % size, second % size
+        if start <= end:
+            return sum(self.counts[start:end])
+        return sum(self.counts[start:]) + sum(self.counts[:end])
+
+
+class EventRates:
+    """
+    Per-second rates of any number of events over a few sliding windows.
+    """
+    WINDOWS = {"1m": 60, "15m": 15 * 60, "1h": 60 * 60}
+
+    def __init__(self):
+        self.counters = {}
+        self.started = int(time.monotonic())
+
+    def add(self, event: str, amount: int = 1):
+        counter = self.counters.get(event)
+        if counter is None:
+            counter = self.counters[event] = SecondCounter(max(self.WINDOWS.values()))
+        counter.add(int(time.monotonic()), amount)
+
+    def rates(self, event: str):
+        """
+        Returns the average events per second over each window. Windows longer than the uptime are cut short.
+        """
+        counter = self.counters.get(event)
+        now = int(time.monotonic())
+        rates = {}
+        for name, seconds in self.WINDOWS.items():
+            seconds = max(min(seconds, now - self.started), 1)
+            rates[name] = counter.total(now, seconds) / seconds if counter is not None else 0.0
+        return rates
+
+
+def timed_call(fn: typing.Callable, args: tuple, kwargs: dict):
+    """
+    Runs a job for `InstrumentedExecutor`. Module level so that process pools can pickle it.
+    """
+    started = time.time()
+    try:
+        result = fn(*args, **kwargs)
+    except Exception as e:
+        return started, time.time(), e, True
+    return started, time.time(), result, False
+
+
+class InstrumentedExecutor(concurrent.futures.Executor):
+    """
+    A named thread or process pool that records how long jobs wait in its queue and how long they take to run.
+    Resizing swaps in a new pool, jobs that were already submitted finish on the old one. If a worker process dies,
+    the jobs it took down fail and the pool is replaced with a fresh, warmed up one.
+    Worker processes are started from a clean server process instead of being forked from the bot, forking a process
+    with other threads running can deadlock the child on a lock that was held at the time.
+    """
+    KINDS = ("thread", "process")
+    START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+    def __init__(self, name: str, *, kind: str = "thread", workers: int = 1, resizable: bool = True):
+        if kind not in self.KINDS:
+            raise ValueError(f"kind must be one of {', '.join(self.KINDS)}, not {kind!r}.")
+        self.name = name
+        self.kind = kind
+        self.workers = workers
+        self.resizable = resizable  # False for jobs that mustn't run concurrently, e.g. on a shared resource
+        self.executor = self.make_executor(workers)
+        self.wait_times = LatencyHistogram()
+        self.run_times = LatencyHistogram()
+        self.submitted = 0
+        self.completed = 0
+        self.restarts = 0
+        self.lock = threading.Lock()  # jobs complete on other threads
+
+    def make_executor(self, workers: int):
+        if self.kind == "process":
+            return concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context(self.START_METHOD))
+        return concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{self.name}-executor")
+
+    @property
+    def in_flight(self):
+        return self.submitted - self.completed
+
+    @property
+    def running(self):
+        return min(self.in_flight, self.workers)
+
+    @property
+    def queued(self):
+        return self.in_flight - self.running
+
+    def submit(self, fn: typing.Callable, /, *args, **kwargs):
+        submitted_at = time.time()
+        with self.lock:
+            self.submitted += 1
+            executor = self.executor
+        try:
+            try:
+                inner = executor.submit(timed_call, fn, args, kwargs)
+            except concurrent.futures.BrokenExecutor:  # broke since the last job finished
+                self.restart(executor)
+                with self.lock:
+                    executor = self.executor
+                inner = executor.submit(timed_call, fn, args, kwargs)
+        except BaseException:  # the job never made it into a pool
+            with self.lock:
+                self.submitted -= 1
+            raise
+        outer = concurrent.futures.Future()
+
+        def done(future: concurrent.futures.Future):
+            try:
+                started, finished, result, failed = future.result()
+            except BaseException as e:  # the pool broke or was shut down before the job finished
+                started = finished = time.time()
+                result, failed = e, True
+                if isinstance(e, concurrent.futures.BrokenExecutor):
+                    self.restart(executor)
+            with self.lock:
+                self.completed += 1
+                self.wait_times.record(started - submitted_at, failed=failed)
+                self.run_times.record(finished - started, failed=failed)
+            if not outer.set_running_or_notify_cancel():
+                return
+            if failed:
+                outer.set_exception(result)
+            else:
+                outer.set_result(result)
+
+        inner.add_done_callback(done)
+        return outer
+
+    def warm_up(self):
+        """
+        Starts every worker now instead of on the first jobs.
+        """
+        with self.lock:
+            executor, workers = self.executor, self.workers
+        for _ in range(workers):
+            executor.submit(os.getpid)
+
+    def restart(self, broken: concurrent.futures.Executor):
+        with self.lock:
+            if self.executor is not broken:  # another job already restarted it
+                return
+            self.executor = self.make_executor(self.workers)
+            self.restarts += 1
+        broken.shutdown(wait=False)
+        self.warm_up()
+
+    def resize(self, workers: int):
+        """
+        Raises ValueError if the executor isn't resizable. Even with the same number of workers, jobs on the old pool
+        would overlap with the ones on the new pool.
+        """
+        if not self.resizable:
+            raise ValueError(f"The {self.name} executor can't be resized.")
+        with self.lock:
+            old, self.executor = self.executor, self.make_executor(workers)
+            self.workers = workers
+        old.shutdown(wait=False)
+        self.warm_up()
+
+    def shutdown(self, wait: bool = True, **kwargs):
+        self.executor.shutdown(wait=wait)
+
+
+class MetricsWriter:
+    """
+    Builds a page in the Prometheus text exposition format.
+    """
+    def __init__(self, prefix: str = "pb"):
+        self.prefix = prefix
+        self.lines = []
+
+    @staticmethod
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+    def metric(self, name: str, kind: str, help_text: str):
+        """
+        Starts a new metric family. Must be called before adding samples to it.
+        """
+        self.lines.append(f"# HELP {self.prefix}_{name} {help_text}")
+        self.lines.append(f"# TYPE {self.prefix}_{name} {kind}")
+
+    def sample(self, name: str, value: float, **labels):
+        if labels:
+            label_str = ",".join(f'{key}="{self.escape(value)}"' for key, value in labels.items())
+            self.lines.append(f"{self.prefix}_{name}{{{label_str}}} {value}")
+        else:
+            self.lines.append(f"{self.prefix}_{name} {value}")
+
+    def render(self):
+        return "\n".join(self.lines) + "\n"
+
+
 # page sources
 
 
+class KeysetPageSource(menus.PageSource):
+    """
+    Page source that fetches one page at a time, starting after the key of the previous page's last entry.
+    Subclasses define `fetch_page(after, limit)` and `get_key(entry)`.
+    """
+    def __init__(self, *, per_page: int):
+        self.per_page = per_page
+        self.pages = {}  # page number -> entries
+        self.last_page = None  # set once we've seen the end of the data
+
+    async def prepare(self):
+        await self.get_page(0)
+
+    def is_paginating(self):
+        return self.last_page != 0
+
+    def get_max_pages(self):
+        return None if self.last_page is None else self.last_page + 1
+
+    async def get_page(self, page_number: int):
+        if page_number < 0 or (self.last_page is not None and page_number > self.last_page):
+            raise IndexError
+        if page_number not in self.pages:
+            # pages are only ever reached one step at a time, so the previous page is always known
+            after = self.get_key(self.pages[page_number - 1][-1]) if page_number else None
+            entries = await self.fetch_page(after, self.per_page + 1)
+            if len(entries) <= self.per_page:
+                self.last_page = page_number
+            self.pages[page_number] = entries[:self.per_page]
+        return self.pages[page_number]
+
+    def page_footer(self, menu: menus.MenuPages):
+        max_pages = self.get_max_pages()
+        return f"Page {menu.current_page + 1}" + (f"/{max_pages}" if max_pages else "")
+
+
 class RawPageSource(menus.ListPageSource):
     def __init__(self, data, *, per_page=1):
         super().__init__(data, per_page=per_page)
@@ -96,6 +888,41 @@ class ErrorSource(menus.ListPageSource):
         return embed
 
 
+class StallSource(menus.ListPageSource):
+    def __init__(self, data):
+        super().__init__(data, per_page=1)
+
+    async def format_page(self, menu: menus.MenuPages, page):
+        stack = page.format_stack()
+        stack = f"```py\n{stack}```" if len(stack) < 1991 else await menu.ctx.bot.mystbin(stack)
+        embed = discord.Embed(title=f"Event Loop Blocked for {page.lag * 1000:.2f}ms", description=stack,
+                              colour=menu.ctx.bot.embed_colour)
+        embed.add_field(name="Location", value=f"`{page.location}`", inline=False)
+        embed.add_field(name="When", value=f"`{page.when:%Y-%m-%d %H:%M:%S}`")
+        embed.set_footer(text=f"Page {menu.current_page + 1}/{self.get_max_pages()} (worst first)")
+        return embed
+
+
+class AllocationSource(menus.ListPageSource):
+    def __init__(self, data, *, title: str):
+        super().__init__(data, per_page=10)
+        self.title = title
+        self.diff = bool(data) and isinstance(data[0], tracemalloc.StatisticDiff)
+
+    async def format_page(self, menu: menus.MenuPages, page):
+        headers = ["Location", "Size", "Diff", "Blocks"] if self.diff else ["Location", "Size", "Blocks"]
+        table = PrettyTable.fancy(headers)
+        for stat in page:
+            frame = stat.traceback[0]
+            row = [f"{short_path(frame.filename)}:{frame.lineno}", humanize.naturalsize(stat.size)]
+            if self.diff:
+                row.append(f"{'+' if stat.size_diff >= 0 else '-'}{humanize.naturalsize(abs(stat.size_diff))}")
+            row.append(f"{stat.count:,}")
+            table.add_row(row)
+        return (f"**{self.title}**\n```\n{table.build_table(autoscale=True)}```"
+                f"\nPage {menu.current_page + 1}/{self.get_max_pages()}")
+
+
 def command_tree(cmds):
     lines = []
 
@@ -118,13 +945,11 @@ class HelpSource(menus.ListPageSource):
     def __init__(self, data):
         super().__init__(data, per_page=1)
 
-    async def format_page(self, menu: menus.MenuPages, page):
+    def render_page(self, menu: menus.MenuPages, page):
         embed = discord.Embed(title="PB Bot Help",
                               description=f"Page {menu.current_page + 1}/{self.get_max_pages()}",
                               colour=menu.ctx.bot.embed_colour)
         embed.set_thumbnail(url=menu.ctx.bot.user.avatar_url)
-        embed.set_footer(text=f"Type {menu.ctx.clean_prefix}help (command) for more info on a command.\n"
-                              f"You can also type {menu.ctx.clean_prefix}help (category) for more info on a category.")
         if menu.current_page == 0:
             embed.add_field(name="About", value=f"```yaml\n{menu.ctx.bot.description}```", inline=False)
 
@@ -139,6 +964,13 @@ class HelpSource(menus.ListPageSource):
             embed.add_field(name=page[0], value=f"```yaml\n{command_tree(_commands)}```")
         return embed
 
+    async def format_page(self, menu: menus.MenuPages, page):
+        key = ("help_page", menu.current_page, self.get_max_pages())
+        embed = menu.ctx.bot.registry.memo(key, lambda: self.render_page(menu, page)).copy()
+        embed.set_footer(text=f"Type {menu.ctx.clean_prefix}help (command) for more info on a command.\n"
+                              f"You can also type {menu.ctx.clean_prefix}help (category) for more info on a category.")
+        return embed
+
 
 class DiscordStatusSource(menus.ListPageSource):
     def format_page(self, menu: menus.MenuPages, page):
@@ -179,14 +1011,24 @@ class DefineSource(menus.ListPageSource):
         return embed
 
 
-class TodoSource(menus.ListPageSource):
-    def __init__(self, data):
-        super().__init__(data, per_page=5)
+class TodoSource(KeysetPageSource):
+    def __init__(self, cache, user_id: int):
+        super().__init__(per_page=5)
+        self.cache = cache
+        self.user_id = user_id
+
+    async def fetch_page(self, after: typing.Optional[int], limit: int):
+        return await self.cache.get_todo_page(self.user_id, after=after, limit=limit)
+
+    def get_key(self, entry):
+        return entry["position"]
 
     async def format_page(self, menu: menus.MenuPages, page):
+        start = menu.current_page * self.per_page + 1
         embed = discord.Embed(
             title=f"Todo List for `{menu.ctx.author}`",
-            description="\n".join(f"**{number}.** {item}" for number, item in page) or "Nothing here!",
+            description="\n".join(f"**{number}.** {entry['task']}" for number, entry in enumerate(page, start=start))
+            or "Nothing here!",
             colour=menu.ctx.bot.embed_colour)
         return embed
 
@@ -209,15 +1051,29 @@ class QueueSource(menus.ListPageSource):
         return embed
 
 
-class BlacklistSource(menus.ListPageSource):
+class BlacklistSource(KeysetPageSource):
+    def __init__(self, pool, *, per_page: int = 10):
+        super().__init__(per_page=per_page)
+        self.pool = pool
+
+    async def fetch_page(self, after: typing.Optional[int], limit: int):
+        if after is None:
+            return await self.pool.fetch(
+                "SELECT user_id, reason FROM blacklisted_users ORDER BY user_id LIMIT $1", limit)
+        return await self.pool.fetch(
+            "SELECT user_id, reason FROM blacklisted_users WHERE user_id > $1 ORDER BY user_id LIMIT $2",
+            after, limit)
+
+    def get_key(self, entry):
+        return entry["user_id"]
+
     async def format_page(self, menu: menus.MenuPages, page):
         embed = discord.Embed(
             title="Blacklisted Users",
             description="```yaml\n" + ("\n".join(
-                f"{user_id} - {reason}" for user_id, reason in page) or "No users in the blacklist.") + "```",
+                f"{entry['user_id']} - {entry['reason']}" for entry in page) or "No users in the blacklist.") + "```",
             colour=menu.ctx.bot.embed_colour)
-        if self.get_max_pages() > 0:
-            embed.set_footer(text=f"Page {menu.current_page + 1}/{self.get_max_pages()}")
+        embed.set_footer(text=self.page_footer(menu))
         return embed
 
 
@@ -226,9 +1082,22 @@ class SocketStatsSource(menus.ListPageSource):
         super().__init__(data, per_page=15)
 
     async def format_page(self, menu: menus.MenuPages, page):
-        table = PrettyTable.fancy(["Event Name", "Total"])
-        for entry in page:
-            table.add_row((entry[0], f"{entry[1]:,}"))
+        table = PrettyTable.fancy(["Event Name", "Total", *(f"{window} (/s)" for window in EventRates.WINDOWS)])
+        for name, total, rates in page:
+            table.add_row((name, f"{total:,}", *(f"{rate:,.2f}" for rate in rates.values())))
+        return (f"```\n{table.build_table(autoscale=True)}```"
+                f"\nPage {menu.current_page + 1}/{self.get_max_pages()}" if self.get_max_pages() > 0 else "")
+
+
+class LatencySource(menus.ListPageSource):
+    def __init__(self, data):
+        super().__init__(data, per_page=10)
+
+    async def format_page(self, menu: menus.MenuPages, page):
+        table = PrettyTable.fancy(["Command", "Uses", "Failed", "p50", "p95", "p99"])
+        for name, histogram in page:
+            table.add_row((name, f"{histogram.total:,}", f"{histogram.failures:,}",
+                           *(f"{histogram.percentile(p) * 1000:,.0f}ms" for p in (50, 95, 99))))
         return (f"```\n{table.build_table(autoscale=True)}```"
                 f"\nPage {menu.current_page + 1}/{self.get_max_pages()}" if self.get_max_pages() > 0 else "")
 